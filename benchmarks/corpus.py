@@ -0,0 +1,158 @@
+import os
+import sys
+import zlib
+import random
+import struct
+import argparse
+
+FORMATS = ("txt", "pdf", "docx", "pptx", "xlsx", "csv", "kml", "png")
+
+WORDS = (
+    "report meeting budget invoice experiment sample analysis project schedule customer "
+    "design review contract proposal result summary data survey sales quarterly annual "
+    "plan product test measurement protocol minutes agenda forecast revenue cost"
+).split()
+
+
+def sentence(rng, n_words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def paragraphs(rng, n_paragraphs):
+    return [" ".join(sentence(rng) for _ in range(rng.randint(3, 8))) for _ in range(n_paragraphs)]
+
+
+def write_txt(path, rng, size):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n\n".join(paragraphs(rng, size)))
+
+
+def write_csv(path, rng, size):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("date,item,quantity,price\n")
+        for i in range(size * 50):
+            f.write(f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d},{rng.choice(WORDS)},{rng.randint(1, 100)},{rng.random() * 1000:.2f}\n")
+
+
+def write_kml(path, rng, size):
+    placemarks = "".join(
+        f"<Placemark><name>{rng.choice(WORDS)} {i}</name><description>{sentence(rng)}</description>"
+        f"<Point><coordinates>{rng.uniform(-180, 180):.5f},{rng.uniform(-90, 90):.5f},0</coordinates></Point></Placemark>"
+        for i in range(size * 5)
+    )
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?><kml xmlns="http://www.opengis.net/kml/2.2"><Document>{placemarks}</Document></kml>')
+
+
+def write_pdf(path, rng, size):
+    # A minimal hand-written PDF with one text page per paragraph, so no PDF writer is needed
+    pages = paragraphs(rng, size)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = [text[i:i + 80].replace("\\", "").replace("(", "").replace(")", "") for i in range(0, len(text), 80)]
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def write_png(path, rng, size):
+    # An uncompressed-looking noise image written with zlib only
+    width = height = 64 * size
+    raw = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(path, 'wb') as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 1)))
+        f.write(chunk(b"IEND", b""))
+
+
+def write_docx(path, rng, size):
+    from docx import Document
+    doc = Document()
+    doc.add_heading(sentence(rng, 4), level=1)
+    for paragraph in paragraphs(rng, size):
+        doc.add_paragraph(paragraph)
+    doc.save(path)
+
+
+def write_pptx(path, rng, size):
+    from pptx import Presentation
+    prs = Presentation()
+    for _ in range(size):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = sentence(rng, 4)
+        slide.placeholders[1].text = sentence(rng)
+    prs.save(path)
+
+
+def write_xlsx(path, rng, size):
+    import pandas as pd
+    rows = [{"item": rng.choice(WORDS), "quantity": rng.randint(1, 100), "price": rng.random() * 1000}
+            for _ in range(size * 50)]
+    pd.DataFrame(rows).to_excel(path, index=False)
+
+
+WRITERS = {
+    "txt": write_txt, "pdf": write_pdf, "docx": write_docx, "pptx": write_pptx,
+    "xlsx": write_xlsx, "csv": write_csv, "kml": write_kml, "png": write_png,
+}
+
+
+def generate_corpus(root, n_files, formats=FORMATS, seed=0, max_depth=3, size=4):
+    """
+    Writes n_files synthetic files of the given formats into a random directory tree under root.
+
+    Args:
+        size (int): Scales the content of every file (paragraphs, pages, rows, image size).
+
+    Returns:
+        list: Paths of the generated files.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        fmt = formats[i % len(formats)]
+        depth = rng.randint(0, max_depth)
+        folder = os.path.join(root, *(f"dir_{rng.randint(0, 9)}" for _ in range(depth)))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{rng.choice(WORDS)}_{i}.{fmt}")
+        WRITERS[fmt](path, rng, rng.randint(1, size))
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates a synthetic directory tree for benchmarks.")
+    parser.add_argument("root")
+    parser.add_argument("-n", "--files", type=int, default=100)
+    parser.add_argument("--formats", default=",".join(FORMATS), help="Comma separated formats.")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    paths = generate_corpus(args.root, args.files, tuple(args.formats.split(",")), args.seed, size=args.size)
+    print(f"Wrote {len(paths)} files to {args.root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
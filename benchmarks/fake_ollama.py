@@ -0,0 +1,199 @@
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+EMBEDDING_DIMENSIONS = 64
+FAKE_MODELS = ("llama3.2:latest", "llama3:latest", "moondream:latest", "nomic-embed-text:latest")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Answers /api/generate, /api/embed, /api/tags and /api/ps like Ollama, with canned but well-formed replies.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients close streams as soon as the JSON object is complete, dropping the connection
+            pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": [{"name": name} for name in FAKE_MODELS]})
+        elif self.path == "/api/ps":
+            with self.server.stats_lock:
+                loaded = sorted(self.server.loaded)
+            self.send_json(200, {"models": [{"name": name} for name in loaded]})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            if payload.get("model"):
+                server.loaded.add(payload["model"])
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+        if random.random() < server.error_rate:
+            with server.stats_lock:
+                server.errors += 1
+            self.send_json(500, {"error": "injected failure"})
+            return
+
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self.send_json(200, {"model": payload.get("model"), "embeddings": [fake_embedding(text) for text in inputs]})
+        elif self.path == "/api/generate":
+            response = fake_response(payload.get("prompt", ""))
+            prompt_tokens = len(payload.get("prompt", "")) // 4
+            if payload.get("stream", True):
+                self.stream_response(payload, response, prompt_tokens)
+            else:
+                self.send_json(200, {
+                    "model": payload.get("model"), "response": response, "done": True,
+                    "prompt_eval_count": prompt_tokens, "eval_count": len(response) // 4,
+                    "prompt_eval_duration": 0, "eval_duration": 0
+                })
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def stream_response(self, payload, response, prompt_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        tokens = re.findall(r"\S+\s*|\s+", response)
+        try:
+            for token in tokens:
+                self.write_chunk({"model": payload.get("model"), "response": token, "done": False})
+                if self.server.token_latency:
+                    time.sleep(self.server.token_latency)
+            self.write_chunk({"model": payload.get("model"), "response": "", "done": True,
+                              "prompt_eval_count": prompt_tokens, "eval_count": len(tokens)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients close the stream as soon as the JSON object is complete
+            self.close_connection = True
+
+    def write_chunk(self, body):
+        line = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+def fake_embedding(text):
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    rng = random.Random(digest)
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+def fake_response(prompt):
+    """
+    Returns a reply matching the kind of request the prompt makes.
+    """
+    if '"categories"' in prompt:
+        return json.dumps({"categories": ["documents", "data", "images", "misc"]})
+    if '"files"' in prompt:
+        files = re.findall(r"^\s*File: (.+)$", prompt, re.MULTILINE)
+        return json.dumps({"files": [
+            {"src_path": path, "folder": ["documents", "data", "images", "misc"][i % 4],
+             "file_name": path.rsplit("/", 1)[-1].lower()}
+            for i, path in enumerate(files)
+        ]})
+    if "Cluster " in prompt:
+        labels = re.findall(r"^\s*Cluster (\d+):", prompt, re.MULTILINE)
+        return json.dumps({label: f"cluster_folder_{label}" for label in labels})
+    if '"summary"' in prompt:
+        return json.dumps({"summary": "A synthetic file used for benchmarking the sorter."}) + " Let me know if you need more."
+    return "A synthetic image with random noise."
+
+
+class FakeOllamaServer:
+    """
+    Runs the fake Ollama API in a background thread.
+
+    Args:
+        latency (float): Seconds added to every request.
+        jitter (float): Maximum random seconds added on top of latency.
+        token_latency (float): Seconds between streamed tokens.
+        error_rate (float): Fraction of requests answered with HTTP 500.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, token_latency=0.0, error_rate=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.jitter = jitter
+        self.httpd.token_latency = token_latency
+        self.httpd.error_rate = error_rate
+        self.httpd.requests = 0
+        self.httpd.errors = 0
+        self.httpd.loaded = set()
+        self.httpd.stats_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self):
+        return {"requests": self.httpd.requests, "errors": self.httpd.errors}
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a fake Ollama API for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    server = FakeOllamaServer(args.host, args.port, args.latency, args.jitter, args.token_latency, args.error_rate)
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
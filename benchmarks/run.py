@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+from contextlib import ExitStack
+from benchmarks.corpus import generate_corpus, FORMATS
+from benchmarks.fake_ollama import FakeOllamaServer
+from modules import dispatcher, file_readers
+from modules.scanner import list_visible_files_recursive
+from modules.file_readers import read_file
+from modules.pipeline import process_files
+from modules.tree_structure import generate_tree_structure
+
+SCENARIOS = ("scan", "readers", "summarize", "tree")
+
+
+def bench_scan(corpus_dir, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        files = list_visible_files_recursive(corpus_dir)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {"files": len(files), "seconds": best, "files_per_second": len(files) / best if best else None}
+
+
+def bench_readers(paths):
+    results = {}
+    by_format = {}
+    for path in paths:
+        by_format.setdefault(os.path.splitext(path)[1].lstrip("."), []).append(path)
+    for fmt, fmt_paths in sorted(by_format.items()):
+        total_bytes = sum(os.path.getsize(path) for path in fmt_paths)
+        errors = 0
+        start = time.perf_counter()
+        for path in fmt_paths:
+            result = read_file(path)
+            if result is None or result.get("error"):
+                errors += 1
+        elapsed = time.perf_counter() - start
+        results[fmt] = {
+            "files": len(fmt_paths), "bytes": total_bytes, "seconds": elapsed, "errors": errors,
+            "files_per_second": len(fmt_paths) / elapsed if elapsed else None,
+            "megabytes_per_second": total_bytes / 1e6 / elapsed if elapsed else None,
+        }
+    return results
+
+
+def bench_summarize(paths, read_workers=None):
+    errors = 0
+    start = time.perf_counter()
+    for _, result in process_files(paths, read_workers=read_workers, use_cache=False, dedup=False):
+        if result is not None and result.get("error"):
+            errors += 1
+    elapsed = time.perf_counter() - start
+    return {"files": len(paths), "seconds": elapsed, "errors": errors,
+            "files_per_second": len(paths) / elapsed if elapsed else None}
+
+
+def bench_tree(file_counts):
+    results = []
+    for count in file_counts:
+        summaries = [
+            {"file_path": f"/bench/dir_{i % 10}/file_{i}.txt", "file_name": f"file_{i}.txt",
+             "summary": "A synthetic file used for benchmarking the sorter. " * 3}
+            for i in range(count)
+        ]
+        start = time.perf_counter()
+        tree = generate_tree_structure(summaries)
+        results.append({"files": count, "seconds": time.perf_counter() - start, "placed": len(tree)})
+    return results
+
+
+def run(scenarios=SCENARIOS, n_files=200, corpus_dir=None, latency=0.05, token_latency=0.0, error_rate=0.0,
+        tree_counts=(50, 200, 1000), read_workers=None, seed=0, hosts=1):
+    """
+    Runs the benchmark scenarios against a synthetic corpus and hosts fake Ollama servers.
+
+    Returns:
+        dict: Machine-readable results, one entry per scenario.
+    """
+    cleanup = corpus_dir is None
+    corpus_dir = corpus_dir or tempfile.mkdtemp(prefix="ml_auto_sorting_bench_")
+    # Thumbnails go to an empty directory, also in reader processes, so that images are decoded
+    # instead of read back from the user's cache
+    thumbnail_dir = tempfile.mkdtemp(prefix="ml_auto_sorting_thumbnails_")
+    previous_thumbnail_dir = file_readers.THUMBNAIL_CACHE_DIR
+    previous_thumbnail_env = os.environ.get("ML_AUTO_SORTING_THUMBNAILS")
+    file_readers.THUMBNAIL_CACHE_DIR = os.environ["ML_AUTO_SORTING_THUMBNAILS"] = thumbnail_dir
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"files": n_files, "latency": latency, "token_latency": token_latency,
+                   "error_rate": error_rate, "seed": seed, "hosts": hosts},
+        "scenarios": {},
+    }
+    try:
+        start = time.perf_counter()
+        paths = generate_corpus(corpus_dir, n_files, FORMATS, seed=seed)
+        report["corpus_seconds"] = time.perf_counter() - start
+
+        if "scan" in scenarios:
+            report["scenarios"]["scan"] = bench_scan(corpus_dir)
+        if "readers" in scenarios:
+            report["scenarios"]["readers"] = bench_readers(paths)
+
+        if "summarize" in scenarios or "tree" in scenarios:
+            with ExitStack() as stack:
+                servers = [
+                    stack.enter_context(FakeOllamaServer(latency=latency, token_latency=token_latency, error_rate=error_rate))
+                    for _ in range(hosts)
+                ]
+                previous_dispatcher = dispatcher._default_dispatcher
+                dispatcher._default_dispatcher = dispatcher.Dispatcher([server.url for server in servers], backoff_seconds=0.01)
+                try:
+                    if "summarize" in scenarios:
+                        report["scenarios"]["summarize"] = bench_summarize(paths, read_workers)
+                    if "tree" in scenarios:
+                        report["scenarios"]["tree"] = bench_tree(tree_counts)
+                finally:
+                    dispatcher._default_dispatcher.close()
+                    dispatcher._default_dispatcher = previous_dispatcher
+                report["fake_ollama"] = [server.stats() for server in servers]
+    finally:
+        if cleanup:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+        shutil.rmtree(thumbnail_dir, ignore_errors=True)
+        file_readers.THUMBNAIL_CACHE_DIR = previous_thumbnail_dir
+        if previous_thumbnail_env is None:
+            os.environ.pop("ML_AUTO_SORTING_THUMBNAILS", None)
+        else:
+            os.environ["ML_AUTO_SORTING_THUMBNAILS"] = previous_thumbnail_env
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks scanning, reading, summarizing and tree generation.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated scenarios to run.")
+    parser.add_argument("-n", "--files", type=int, default=200)
+    parser.add_argument("--corpus-dir", help="Keep the generated corpus in this directory.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds of fake LLM latency per request.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed tokens.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tree-counts", default="50,200,1000", help="Comma separated file counts for the tree scenario.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--hosts", type=int, default=1, help="Number of fake Ollama servers to balance across.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file (default: stdout).")
+    args = parser.parse_args(argv)
+
+    report = run(
+        scenarios=tuple(args.scenarios.split(",")), n_files=args.files, corpus_dir=args.corpus_dir,
+        latency=args.latency, token_latency=args.token_latency, error_rate=args.error_rate,
+        tree_counts=tuple(int(count) for count in args.tree_counts.split(",")),
+        read_workers=args.workers, seed=args.seed, hosts=args.hosts
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import sys
+import argparse
+import logging
+from modules.engine import run, regenerate_plan, resolve_plan, write_plan_jsonl, read_plan_jsonl, TREE_MODES
+from modules.executor import apply_plan, undo_plan, journal_path_for, DEFAULT_COPY_WORKERS
+from modules.checkpoint import checkpoint_path_for, discard_checkpoint
+from modules.scanner import record_moves
+from modules.metrics import get_metrics
+from modules.watcher import watch, DEFAULT_SETTLE_SECONDS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sorts the files of a directory with a local LLM, without the Streamlit UI.")
+    parser.add_argument("directory", nargs="?", help="Directory to sort.")
+    parser.add_argument("-o", "--output", help="Write the proposed plan as JSON Lines to this file (default: stdout).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of reader processes (default: CPU count).")
+    parser.add_argument("--model-concurrency", action="append", default=[], metavar="MODEL=N",
+                        help="Concurrent requests for a model, e.g. llama3.2=8. Can be repeated.")
+    parser.add_argument("--mode", choices=TREE_MODES, default="llm", help="How destinations are proposed.")
+    parser.add_argument("--changed-only", action="store_true", help="Only process files added or changed since the last scan.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not reuse or store cached summaries.")
+    parser.add_argument("--no-dedup", action="store_true", help="Summarize duplicate files separately.")
+    parser.add_argument("--resume-run", action="store_true",
+                        help="Continue the interrupted run of the directory from its checkpoint.")
+    parser.add_argument("--tree-only", action="store_true",
+                        help="Generate the tree again from the checkpointed summaries without summarizing.")
+    parser.add_argument("--plan", help="Apply an existing JSON Lines plan instead of generating one.")
+    parser.add_argument("--journal", help="Journal file recording the moves (default: a new file under the directory).")
+    parser.add_argument("--copy-workers", type=int, default=DEFAULT_COPY_WORKERS,
+                        help="Parallel copies for moves across filesystems.")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write per-stage timings to this file, in the Prometheus text format if it ends in .prom, else JSON.")
+    parser.add_argument("--target", help="With --watch, the sorted tree new files are placed into (default: the directory).")
+    parser.add_argument("--settle-seconds", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="With --watch, how long a new file must stay unchanged before it is sorted.")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--dry-run", action="store_true", help="Only write the plan (default).")
+    action.add_argument("--apply", action="store_true", help="Move the files according to the plan.")
+    action.add_argument("--resume", metavar="JOURNAL", help="Resume an interrupted --apply from its journal.")
+    action.add_argument("--undo", metavar="JOURNAL", help="Move every file recorded in a journal back.")
+    action.add_argument("--watch", action="store_true",
+                        help="Keep watching the directory and move every new file into the existing tree.")
+    args = parser.parse_args(argv)
+    if not args.directory and not args.plan and not args.resume and not args.undo:
+        parser.error("a directory, --plan, --resume or --undo is required")
+    return args
+
+
+def parse_model_concurrency(values):
+    limits = {}
+    for value in values:
+        model, _, limit = value.rpartition("=")
+        limits[model] = int(limit)
+    return limits
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logger = logging.getLogger("cli")
+    if args.directory:
+        args.directory = os.path.abspath(args.directory)
+
+    if args.watch:
+        if not args.directory or not os.path.isdir(args.directory):
+            logger.error("--watch needs an existing directory")
+            return 2
+        try:
+            watch(
+                args.directory, args.target, settle_seconds=args.settle_seconds, read_workers=args.workers,
+                model_concurrency=parse_model_concurrency(args.model_concurrency), use_cache=not args.no_cache
+            )
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.undo:
+        results = undo_plan(args.undo, copy_workers=args.copy_workers)
+        return report_moves(logger, results, "restored")
+    if args.resume:
+        results = apply_plan([], args.resume, copy_workers=args.copy_workers, resume=True)
+        return report_moves(logger, results, "moved")
+
+    if args.plan:
+        with open(args.plan, 'r', encoding='utf-8') as f:
+            plan = read_plan_jsonl(f)
+    else:
+        if not os.path.isdir(args.directory):
+            logger.error("Not a directory: %s", args.directory)
+            return 2
+
+        def on_result(done, total, file_path, result):
+            if result is not None and result.get("error"):
+                logger.warning("[%d/%d] %s: %s", done, total, file_path, result.get("summary"))
+            elif done % 100 == 0 or done == total:
+                logger.info("[%d/%d] files processed", done, total)
+
+        if args.tree_only:
+            plan, remaining = regenerate_plan(args.directory, args.mode)
+            if plan is None:
+                logger.error("No checkpointed run for %s", args.directory)
+                return 2
+            if remaining:
+                logger.warning("%d files of the checkpointed run are not summarized yet", len(remaining))
+            plan = resolve_plan(plan, args.directory)
+            logger.info("Proposed destinations for %d files", len(plan))
+        else:
+            plan, error_files = run(
+                args.directory, read_workers=args.workers,
+                model_concurrency=parse_model_concurrency(args.model_concurrency),
+                use_cache=not args.no_cache, changed_only=args.changed_only, mode=args.mode,
+                on_result=on_result, dedup=not args.no_dedup, resume=args.resume_run
+            )
+            logger.info("Proposed destinations for %d files, %d errors", len(plan), len(error_files))
+            counters = get_metrics().to_dict()["counters"]
+            if not args.no_cache:
+                logger.info("Summary cache: %d hits, %d misses", counters.get("cache.hits", 0), counters.get("cache.misses", 0))
+        if args.metrics:
+            write_metrics(args.metrics)
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                write_plan_jsonl(plan, f)
+        else:
+            write_plan_jsonl(plan, sys.stdout)
+
+    if args.apply:
+        if args.journal:
+            journal_path = args.journal
+        elif args.directory:
+            journal_path = journal_path_for(args.directory)
+        else:
+            journal_path = args.plan + ".journal.jsonl"
+        logger.info("Journal: %s", journal_path)
+        results = apply_plan(plan, journal_path, copy_workers=args.copy_workers)
+        if args.directory:
+            # The checkpointed run lists files at their old paths, so it can no longer be resumed
+            discard_checkpoint(checkpoint_path_for(args.directory))
+            record_moves(args.directory, [
+                (result["src_path"], result["dst_path"]) for result in results if result["status"] == "moved"
+            ])
+        return report_moves(logger, results, "moved")
+    return 0
+
+
+def write_metrics(path):
+    metrics = get_metrics()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(metrics.to_prometheus() if path.endswith(".prom") else metrics.to_json())
+
+
+def report_moves(logger, results, done_status):
+    for result in results:
+        if result["status"] == "error":
+            logger.error("Failed to move %s -> %s: %s", result["src_path"], result["dst_path"], result["error_msg"])
+    done = sum(1 for result in results if result["status"] == done_status)
+    errors = sum(1 for result in results if result["status"] == "error")
+    logger.info("%s %d of %d files", done_status.capitalize(), done, len(results))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
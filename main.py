@@ -1,17 +1,17 @@
 import os
 import json
 import streamlit as st
-from modules.file_readers import (
-    read_pdf, read_doc, read_py, read_txt, read_pptx, 
-    read_excel, read_csv, read_kml, read_image
-)
-from modules.summarization import (
-    summarize_with_ollama, summarize_image_with_moondream
-)
-from modules.tree_structure import generate_tree_structure
-from modules.utils import (
-    list_visible_files_recursive, create_tree_buttons, display_error_files
-)
+from modules.pipeline import MODEL_CONCURRENCY
+from modules.dispatcher import get_dispatcher
+from modules.engine import list_target_files, summarize_files, generate_plan, commit_scan, TREE_MODES
+from modules.checkpoint import RunCheckpoint, checkpoint_path_for, load_checkpoint, split_checkpoint
+from modules.metrics import get_metrics
+from modules.utils import create_plan_editor, reset_plan_state, display_error_files, display_metrics
+
+TREE_MODE_LABELS = {
+    "llm": "LLMで仕訳先を作成",
+    "cluster": "埋め込みのクラスタリングで仕訳先を作成（高速）",
+}
 
 # Set the page layout to wide
 st.set_page_config(page_title="LLMを使った自動ファイル仕訳機能", layout="wide")
@@ -34,111 +34,166 @@ with col2:
     # Add the "仕訳開始" button next to the directory input
     start_button = st.button("仕訳開始")
 
+# Concurrency settings for reading files and for each model
+with st.expander("並列処理の設定"):
+    read_workers = st.number_input("ファイル読み込みのプロセス数", min_value=1, value=os.cpu_count() or 1)
+    model_concurrency = {
+        model: st.number_input(f"{model}の同時リクエスト数", min_value=1, value=limit * len(get_dispatcher().endpoints))
+        for model, limit in MODEL_CONCURRENCY.items()
+    }
+    use_cache = st.checkbox("変更のないファイルは前回の要約を再利用する", value=True)
+    tree_mode = st.radio("仕訳先の作成方法", TREE_MODES, format_func=TREE_MODE_LABELS.get)
+    changed_only = st.checkbox("前回のスキャンから追加・変更されたファイルのみ処理する", value=False)
+    dedup = st.checkbox("重複・ほぼ同じ内容のファイルは一度だけ要約する", value=True)
+
 # Initialize session state variables
 if 'summaries' not in st.session_state:
     st.session_state.summaries = []
 if 'new_tree' not in st.session_state:
     st.session_state.new_tree = []
-if 'inputs' not in st.session_state:
-    st.session_state.inputs = {}
+if 'moved' not in st.session_state:
+    reset_plan_state()
 if 'error_files' not in st.session_state:
     st.session_state.error_files = []
 if 'last_directory' not in st.session_state:
     st.session_state.last_directory = ""
+if 'checkpoint_info' not in st.session_state:
+    st.session_state.checkpoint_info = None
 
 # Main logic
 if directory:
+    # Scanned paths must be absolute, since files that stay in place keep their source path as destination
+    directory = os.path.abspath(directory)
+
     # Check if the directory has changed since the last run
     if directory != st.session_state.last_directory:
         # If directory has changed, reset the session state
         st.session_state.summaries = []
         st.session_state.new_tree = []
         st.session_state.error_files = []
-        st.session_state.inputs = {}
+        reset_plan_state()
         st.session_state.last_directory = directory
-
-    if start_button:
+        st.session_state.checkpoint_info = None
+
+    # Offer to continue a run whose progress was checkpointed, e.g. before a refresh or a crash
+    resume_button = regenerate_button = False
+    checkpoint_path = checkpoint_path_for(directory)
+    # The checkpoint is read and its files checked once per directory and run, not on every rerun
+    if st.session_state.checkpoint_info is None and os.path.isdir(directory):
+        state = load_checkpoint(checkpoint_path)
+        st.session_state.checkpoint_info = (state, *split_checkpoint(state)) if state else (None, [], [])
+    checkpoint_state, done_summaries, remaining_files = st.session_state.checkpoint_info or (None, [], [])
+    # A run that finished with a plan has nothing left to resume
+    finished = checkpoint_state is not None and not remaining_files and checkpoint_state["plan"] is not None
+    if checkpoint_state and not finished and not start_button:
+        st.info(f"前回の処理結果が保存されています（要約済み: {len(done_summaries)}件 / 未処理: {len(remaining_files)}件）")
+        resume_col, regenerate_col = st.columns(2)
+        with resume_col:
+            resume_button = st.button("続きから再開", disabled=not remaining_files)
+        with regenerate_col:
+            regenerate_button = st.button("仕訳先のみ再作成", disabled=not done_summaries)
+
+    if start_button or resume_button or regenerate_button:
+        st.session_state.checkpoint_info = None
+
+    if regenerate_button:
+        st.session_state.summaries = done_summaries
+        st.session_state.error_files = []
+        reset_plan_state()
+        st.write("仕訳先作成中。数分間かかります。")
+        checkpoint = RunCheckpoint(checkpoint_path)
+        try:
+            st.session_state.new_tree = generate_plan(done_summaries, tree_mode, checkpoint)
+        finally:
+            checkpoint.close()
+        if not st.session_state.new_tree:
+            st.error("仕訳先の作成に失敗しました。")
+
+    if start_button or resume_button:
         if os.path.isdir(directory):
             # Clear previous summaries and errors if reprocessing
             st.session_state.summaries = []
             st.session_state.new_tree = []
             st.session_state.error_files = []
-
-            visible_files = list_visible_files_recursive(directory)
+            reset_plan_state()
+            get_metrics().reset()
+
+            if resume_button:
+                # Only the files the interrupted run did not finish are processed
+                visible_files = remaining_files
+                checkpoint = RunCheckpoint(checkpoint_path)
+                st.write(f"前回の要約を引き継ぎ: {len(done_summaries)}件")
+            else:
+                visible_files = list_target_files(directory, changed_only)
+                checkpoint = RunCheckpoint(checkpoint_path, visible_files, directory, tree_mode)
+                done_summaries = []
 
             st.write(f"{len(visible_files)}ファイルを読み込み中...")
 
-            if visible_files:
+            if visible_files or done_summaries:
                 progress_bar = st.progress(0)
-                total_files = len(visible_files)
-
-                summaries = []
-                for idx, file_path in enumerate(visible_files):
-                    progress_percentage = int((idx + 1) / total_files * 100)
-                    progress_bar.progress(progress_percentage)
-
-                    if file_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        image_data = read_image(file_path)
-                        if image_data.get("error"):
-                            st.session_state.error_files.append({
-                                "file_name": image_data.get("file_name"),
-                                "file_path": image_data.get("image_path"),
-                                "summary": image_data.get("error_msg", "画像の読み込みエラー"),
-                                "error": True
-                            })
-                            continue
-                        summary = summarize_image_with_moondream(image_data)
-                        if summary.get("error"):
-                            st.session_state.error_files.append(summary)
-                        else:
-                            summaries.append(summary)
-                        continue
-                    elif file_path.endswith('.pdf'):
-                        file_content = read_pdf(file_path)
-                    elif file_path.endswith(('.docx', '.doc')):
-                        file_content = read_doc(file_path)
-                    elif file_path.endswith('.py'):
-                        file_content = read_py(file_path)
-                    elif file_path.endswith('.txt'):
-                        file_content = read_txt(file_path)
-                    elif file_path.endswith('.pptx'):
-                        file_content = read_pptx(file_path)
-                    elif file_path.endswith('.xlsx'):
-                        file_content = read_excel(file_path)
-                    elif file_path.endswith('.csv'):
-                        file_content = read_csv(file_path)
-                    elif file_path.endswith('.kml'):
-                        file_content = read_kml(file_path)
+                partial_box = st.empty()
+
+                # Partial summaries are written by the worker threads and rendered from this thread
+                partial_summaries = {}
+
+                def on_partial(file_path, partial):
+                    partial_summaries[file_path] = partial
+
+                def show_partial_summaries():
+                    lines = [
+                        f"- `{os.path.basename(file_path)}`: {partial}"
+                        for file_path, partial in list(partial_summaries.items())[-5:]
+                    ]
+                    partial_box.markdown("\n".join(lines))
+
+                def on_result(done, total, file_path, result):
+                    progress_bar.progress(int(done / total * 100))
+                    partial_summaries.pop(file_path, None)
+                    show_partial_summaries()
+                    if result is not None and result.get("error"):
+                        st.session_state.error_files.append(result)
+
+                try:
+                    summaries, _ = summarize_files(
+                        visible_files, read_workers=read_workers, model_concurrency=model_concurrency,
+                        use_cache=use_cache, on_result=on_result,
+                        on_partial=on_partial, on_idle=show_partial_summaries, dedup=dedup, checkpoint=checkpoint
+                    )
+                    partial_box.empty()
+                    cache_hits = sum(1 for summary in summaries if summary.pop("cached", False))
+
+                    summaries = done_summaries + summaries
+                    st.session_state.summaries = summaries
+                    progress_bar.progress(100)
+                    if use_cache:
+                        st.write(f"キャッシュ済みの要約を再利用: {cache_hits}件 / 新規に要約: {len(summaries) - len(done_summaries) - cache_hits}件")
+                    st.write("仕訳先作成中。数分間かかります。")
+
+                    if summaries:
+                        st.session_state.new_tree = generate_plan(summaries, tree_mode, checkpoint)
+                        if not st.session_state.new_tree:
+                            st.error("仕訳先の作成に失敗しました。「仕訳先のみ再作成」で要約をやり直さずに再試行できます。")
                     else:
-                        continue  # Unsupported file type
-
-                    if file_content.get("error"):
-                        st.session_state.error_files.append(file_content)
-                        continue
-
-                    summary = summarize_with_ollama(file_content)
-                    if summary.get("error"):
-                        st.session_state.error_files.append(summary)
-                    else:
-                        summaries.append(summary)
-
-                st.session_state.summaries = summaries
-                progress_bar.progress(100)
-                st.write("仕訳先作成中。数分間かかります。")
-
-                if summaries:
-                    new_tree_response = generate_tree_structure(summaries)
-                    st.session_state.new_tree = new_tree_response
-                else:
-                    st.write("エラーのため、仕訳先を作成できませんでした。")
+                        st.write("エラーのため、仕訳先を作成できませんでした。")
+                    if changed_only and (st.session_state.new_tree or not summaries):
+                        # Files are only marked as scanned once the run has produced its plan
+                        scanned_files = checkpoint_state["file_paths"] if resume_button else visible_files
+                        commit_scan(directory, scanned_files, st.session_state.error_files)
+                finally:
+                    checkpoint.close()
             else:
+                checkpoint.close()
                 st.write("入力したディレクトリ先にファイルがありません。")
         else:
             st.error("有効なディレクトリを入力して下さい。")
 
-    # Display the tree buttons and error files only if processing has been done
+    # Display the plan and error files only if processing has been done
     if st.session_state.new_tree:
-        create_tree_buttons(st.session_state.new_tree, directory)
+        create_plan_editor(st.session_state.new_tree, directory)
 
     if st.session_state.error_files:
         display_error_files(st.session_state.error_files)
+
+    if st.session_state.summaries:
+        display_metrics(get_metrics())
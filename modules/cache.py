@@ -0,0 +1,201 @@
+import os
+import json
+import atexit
+import time
+import hashlib
+import sqlite3
+import threading
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "ml_auto_sorting", "summaries.sqlite3"
+)
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Cache hits whose access time is written in one transaction
+TOUCH_BATCH_SIZE = 500
+
+
+def file_digest(file_path):
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """
+    On-disk cache of file summaries keyed on content hash, model name and prompt version.
+
+    Entries older than max_age_seconds are ignored and removed, and the least recently used
+    entries are evicted once the cache grows beyond max_entries. Content hashes are remembered
+    per file path, size, mtime and inode, so that unchanged files are not hashed again.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        # Access times of cache hits not written yet, keyed like the summaries table
+        self._touched = {}
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, a crash can lose only the last commits, never corrupt the cache
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS summaries (
+                content_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, model, prompt_version)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_accessed ON summaries (accessed_at)")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS digests (
+                file_path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def digest(self, file_path):
+        """
+        Returns the content hash of a file, hashing it only if its size, mtime or inode changed
+        since it was last hashed.
+        """
+        stat = os.stat(file_path)
+        state = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, content_hash FROM digests WHERE file_path = ?", (file_path,)
+            ).fetchone()
+        if row is not None and tuple(row[:3]) == state:
+            return row[3]
+        content_hash = file_digest(file_path)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?)", (file_path, *state, content_hash))
+            self._conn.commit()
+        return content_hash
+
+    def get(self, content_hash, model, prompt_version):
+        """
+        Returns the cached summary dict, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, created_at FROM summaries WHERE content_hash = ? AND model = ? AND prompt_version = ?",
+                (content_hash, model, prompt_version)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            # Access times only order eviction, so they are written in batches instead of per hit
+            self._touched[(content_hash, model, prompt_version)] = now
+            if len(self._touched) >= TOUCH_BATCH_SIZE:
+                self._flush_touched()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def _flush_touched(self):
+        if not self._touched:
+            return
+        self._conn.executemany(
+            "UPDATE summaries SET accessed_at = ? WHERE content_hash = ? AND model = ? AND prompt_version = ?",
+            [(now, *key) for key, now in self._touched.items()]
+        )
+        self._conn.commit()
+        self._touched = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush_touched()
+
+    def put(self, content_hash, model, prompt_version, summary):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, model, prompt_version, json.dumps(summary, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= 1000:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        self._puts_since_evict = 0
+        self._flush_touched()
+        self._conn.execute("DELETE FROM summaries WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+        self._conn.execute(
+            """DELETE FROM summaries WHERE rowid IN (
+                SELECT rowid FROM summaries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,)
+        )
+        # Hashes of files whose summary is gone are not worth keeping
+        self._conn.execute("DELETE FROM digests WHERE content_hash NOT IN (SELECT content_hash FROM summaries)")
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def clear(self):
+        with self._lock:
+            self._touched = {}
+            self._conn.execute("DELETE FROM summaries")
+            self._conn.execute("DELETE FROM digests")
+            self._conn.commit()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    Returns the process-wide summary cache, creating it on first use.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SummaryCache(os.environ.get("ML_AUTO_SORTING_CACHE", DEFAULT_CACHE_PATH))
+            atexit.register(_default_cache.flush)
+        return _default_cache
+
+
+def _reset_default_cache():
+    # SQLite connections must not be used across fork, and the parent's lock may be held by one of
+    # its threads at that moment, so a forked child opens a cache of its own
+    global _default_cache, _default_cache_lock
+    _default_cache = None
+    _default_cache_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_default_cache)
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_RUNS_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "ml_auto_sorting", "runs"
+)
+
+
+def checkpoint_path_for(directory, runs_dir=DEFAULT_RUNS_DIR):
+    """
+    Returns the run-state file of directory. Each directory has one, overwritten by every new run.
+    """
+    key = hashlib.sha1(os.path.abspath(directory).encode("utf-8")).hexdigest()
+    return os.path.join(runs_dir, key + ".jsonl")
+
+
+def _file_state(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class RunCheckpoint:
+    """
+    Append-only record of a run: the files to process, every result as it finishes and the final plan.
+
+    Passing file_paths starts a new run and replaces any previous checkpoint at path. Without it,
+    records are appended to the existing checkpoint of an interrupted run.
+    """
+
+    def __init__(self, path, file_paths=None, directory=None, mode=None):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if file_paths is None:
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+            self.write({
+                "type": "start", "directory": directory, "mode": mode,
+                "file_paths": list(file_paths), "time": time.time()
+            })
+
+    def write(self, record, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def record_result(self, file_path, result):
+        """
+        Records the result of a file (None for unsupported files) with its size and mtime,
+        so that a resumed run can tell whether the file changed in the meantime.
+        """
+        if result is not None:
+            result = {key: value for key, value in result.items() if key != "cached"}
+        self.write({"type": "result", "file_path": file_path, "file_state": _file_state(file_path), "result": result})
+
+    def record_plan(self, plan, mode=None):
+        self.write({"type": "plan", "mode": mode, "items": plan}, sync=True)
+
+    def close(self):
+        self._file.close()
+
+
+def load_checkpoint(path):
+    """
+    Reads a run-state file.
+
+    Returns:
+        dict or None: {"directory", "mode", "file_paths", "results", "plan", "plan_mode", "time"} where
+            results maps each finished file to its record, or None if there is no checkpoint.
+    """
+    if not os.path.exists(path):
+        return None
+    state = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # A torn last line from a crash
+            if record["type"] == "start":
+                state = {
+                    "directory": record["directory"], "mode": record["mode"], "file_paths": record["file_paths"],
+                    "time": record["time"], "results": {}, "plan": None, "plan_mode": None
+                }
+            elif state is None:
+                continue
+            elif record["type"] == "result":
+                state["results"][record["file_path"]] = record
+            elif record["type"] == "plan":
+                state["plan"] = record["items"]
+                state["plan_mode"] = record["mode"]
+    return state
+
+
+def split_checkpoint(state):
+    """
+    Separates the files of a checkpointed run into those already done and those left.
+
+    Files that failed or changed since their result was recorded are processed again.
+
+    Returns:
+        tuple: (summaries, remaining) where summaries are the stored results of the finished files
+            and remaining lists the file paths still to process.
+    """
+    summaries, remaining = [], []
+    for file_path in state["file_paths"]:
+        record = state["results"].get(file_path)
+        if record is None or record["file_state"] != _file_state(file_path):
+            remaining.append(file_path)
+        elif record["result"] is None:
+            continue  # Unsupported file type
+        elif record["result"].get("error"):
+            remaining.append(file_path)
+        else:
+            summaries.append(record["result"])
+    return summaries, remaining
+
+
+def discard_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
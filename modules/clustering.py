@@ -0,0 +1,176 @@
+import os
+import logging
+import numpy as np
+import requests
+from modules.dispatcher import get_dispatcher
+from modules.tree_structure import normalize_folder_name, request_json
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.environ.get("ML_AUTO_SORTING_EMBEDDING_MODEL", "nomic-embed-text")
+EMBEDDING_BATCH_SIZE = 64
+MAX_CLUSTERS = 30
+
+# Number of summaries closest to each centroid that are shown to the model when naming a cluster
+REPRESENTATIVES_PER_CLUSTER = 3
+
+
+def embed_with_ollama(texts, api_url=None, model=EMBEDDING_MODEL):
+    """
+    Embeds texts with an Ollama embedding model.
+
+    Returns:
+        numpy.ndarray: An array of shape (len(texts), dimensions).
+    """
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        payload = {"model": model, "input": texts[start:start + EMBEDDING_BATCH_SIZE]}
+        embeddings.extend(get_dispatcher().embed(payload, url=api_url)["embeddings"])
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def default_cluster_count(n_items):
+    return int(min(MAX_CLUSTERS, max(1, round(np.sqrt(n_items / 2)))))
+
+
+def kmeans(vectors, n_clusters, n_iter=100, seed=0):
+    """
+    Clusters the rows of vectors with k-means (k-means++ initialization).
+    The fixed seed makes the placement deterministic for the same input.
+
+    Returns:
+        tuple: (labels, centroids)
+    """
+    rng = np.random.default_rng(seed)
+    n_items = len(vectors)
+    n_clusters = min(n_clusters, n_items)
+    squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    centroids = np.empty((n_clusters, vectors.shape[1]), dtype=vectors.dtype)
+    centroids[0] = vectors[rng.integers(n_items)]
+    closest = np.full(n_items, np.inf)
+    for i in range(1, n_clusters):
+        closest = np.minimum(closest, ((vectors - centroids[i - 1]) ** 2).sum(axis=1))
+        total = closest.sum()
+        index = rng.choice(n_items, p=closest / total) if total > 0 else rng.integers(n_items)
+        centroids[i] = vectors[index]
+
+    labels = np.zeros(n_items, dtype=int)
+    for iteration in range(n_iter):
+        distances = squared_norms[:, None] - 2 * vectors @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        new_labels = distances.argmin(axis=1)
+        if iteration > 0 and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for i in range(n_clusters):
+            members = vectors[labels == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+    return labels, centroids
+
+
+def name_clusters(summaries, vectors, labels, centroids, api_url=None):
+    """
+    Asks the model for a folder name per cluster using the summaries closest to each centroid.
+
+    Returns:
+        dict: Folder names keyed by cluster label.
+    """
+    clusters_text = []
+    for label in range(len(centroids)):
+        members = np.flatnonzero(labels == label)
+        if not len(members):
+            continue
+        distances = ((vectors[members] - centroids[label]) ** 2).sum(axis=1)
+        closest = members[np.argsort(distances)[:REPRESENTATIVES_PER_CLUSTER]]
+        examples = "\n".join(f"  - {summaries[i]['file_name']}: {summaries[i]['summary'][:200]}" for i in closest)
+        clusters_text.append(f"Cluster {label}:\n{examples}")
+    clusters_text = "\n".join(clusters_text)
+
+    prompt = f"""
+    You must return strictly valid JSON, no extra formatting or keys.
+
+    You will be provided with clusters of related files, each with a few example files and summaries.
+    Propose a short, distinct folder name for each cluster. Folder names must use only lowercase letters, digits and underscores.
+
+    Clusters:
+    \"\"\"
+    {clusters_text}
+    \"\"\"
+
+    Your response must ONLY be a JSON object mapping each cluster number to its folder name:
+    {{
+        "0": "folder_name"
+    }}
+
+    Do not include any additional text or formatting."""
+
+    data = request_json(prompt, api_url)
+    names = {}
+    for label, name in data.items():
+        try:
+            names[int(label)] = normalize_folder_name(name)
+        except (TypeError, ValueError):
+            continue
+    return names
+
+
+def generate_tree_by_clustering(summaries, n_clusters=None, embedder=None,
+                                api_url=None):
+    """
+    Generates a tree structure by clustering summary embeddings and letting the LLM name only the clusters.
+
+    Args:
+        summaries (list): A list of dictionaries containing summaries, file names, and file paths.
+        n_clusters (int): Number of folders. Defaults to a value derived from the number of files.
+        embedder (callable): Maps a list of texts to an array of embeddings. Defaults to embed_with_ollama.
+
+    Returns:
+        list: Dictionaries with "src_path", "summary" and "dst_path" (relative to the sorted directory).
+    """
+    if not summaries:
+        return []
+    embedder = embedder or embed_with_ollama
+
+    try:
+        vectors = np.asarray(embedder([f"{s['file_name']}\n{s['summary']}" for s in summaries]), dtype=np.float32)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        logger.error(f"Error embedding summaries: {e}")
+        return []
+
+    # Cosine similarity works better than raw distances for text embeddings
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+
+    labels, centroids = kmeans(vectors, n_clusters or default_cluster_count(len(summaries)))
+
+    try:
+        names = name_clusters(summaries, vectors, labels, centroids, api_url)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Failed to name clusters: {e}")
+        names = {}
+
+    # Make folder names unique so that two clusters never end up merged by name
+    folders = {}
+    used = set()
+    for label in range(len(centroids)):
+        name = names.get(label) or f"cluster_{label + 1}"
+        unique_name, counter = name, 2
+        while unique_name in used:
+            unique_name = f"{name}_{counter}"
+            counter += 1
+        used.add(unique_name)
+        folders[label] = unique_name
+
+    tree = []
+    used_dst = set()
+    for s, label in zip(summaries, labels.tolist()):
+        stem, ext = os.path.splitext(os.path.basename(s["file_path"]))
+        dst_path = os.path.join(folders[label], stem + ext)
+        counter = 1
+        while dst_path in used_dst:
+            dst_path = os.path.join(folders[label], f"{stem}_{counter}{ext}")
+            counter += 1
+        used_dst.add(dst_path)
+        tree.append({"src_path": s["file_path"], "summary": s["summary"], "dst_path": dst_path})
+    return tree
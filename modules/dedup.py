@@ -0,0 +1,157 @@
+import os
+import re
+import hashlib
+from modules.cache import file_digest
+
+# Bytes hashed from each end of a file before falling back to a full hash
+PARTIAL_HASH_BYTES = 64 * 1024
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+# Fingerprints that differ in at most this many bits are near-duplicates.
+# It must stay below SIMHASH_BANDS so that two near-duplicates always share an identical band.
+NEAR_DUPLICATE_DISTANCE = 3
+SHINGLE_SIZE = 3
+
+
+def partial_digest(file_path, size):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES:
+            f.seek(max(PARTIAL_HASH_BYTES, size - PARTIAL_HASH_BYTES))
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+    return digest.hexdigest()
+
+
+def _group_by(paths, key):
+    groups = {}
+    for path in paths:
+        try:
+            groups.setdefault(key(path), []).append(path)
+        except OSError:
+            groups.setdefault(("error", path), []).append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def group_exact_duplicates(file_paths):
+    """
+    Groups files with identical content.
+
+    Files are grouped by size first, then by a hash of their first and last bytes, and only
+    the remaining candidates are hashed in full, so unique files are rarely read at all.
+
+    Returns:
+        dict: Maps the first file of each group to the list of its other members.
+    """
+    sizes = {}
+    for file_path in file_paths:
+        try:
+            sizes.setdefault(os.stat(file_path).st_size, []).append(file_path)
+        except OSError:
+            continue
+
+    duplicates = {}
+    for size, same_size in sizes.items():
+        if len(same_size) < 2:
+            continue
+        for same_partial in _group_by(same_size, lambda path: partial_digest(path, size)):
+            if size <= 2 * PARTIAL_HASH_BYTES:
+                # The partial hash already covered the whole file
+                groups = [same_partial]
+            else:
+                groups = _group_by(same_partial, file_digest)
+            for group in groups:
+                duplicates[group[0]] = group[1:]
+    return duplicates
+
+
+def shingles(text):
+    """
+    Returns the word shingles of text, or character shingles for text without spaces such as Japanese.
+    """
+    words = re.findall(r"\w+", text.lower())
+    # Long runs without word breaks mean a language such as Japanese that is not space separated
+    if len(words) < SHINGLE_SIZE or len(text) / len(words) > 12:
+        compact = re.sub(r"\s+", "", text.lower())
+        return {compact[i:i + SHINGLE_SIZE + 1] for i in range(max(1, len(compact) - SHINGLE_SIZE))}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def simhash(text):
+    """
+    Returns the 64-bit SimHash fingerprint of text.
+    """
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles(text):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+class NearDuplicateIndex:
+    """
+    Finds near-duplicate SimHash fingerprints by splitting them into bands and looking up
+    each band exactly, instead of comparing against every fingerprint seen so far.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        self.band_bits = SIMHASH_BITS // SIMHASH_BANDS
+        self.buckets = {}
+
+    def _bands(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, fingerprint >> (band * self.band_bits) & mask) for band in range(SIMHASH_BANDS)]
+
+    def find(self, fingerprint):
+        """
+        Returns the key of a near-duplicate fingerprint, or None.
+        """
+        for band in self._bands(fingerprint):
+            for other, key in self.buckets.get(band, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, fingerprint, key):
+        for band in self._bands(fingerprint):
+            self.buckets.setdefault(band, []).append((fingerprint, key))
+
+
+def attach_duplicates(plan, duplicates):
+    """
+    Places duplicate files in the same folder as the file they duplicate.
+
+    Args:
+        plan (list): The tree generated for the unique files.
+        duplicates (list): Summaries carrying "duplicate_of" (or "near_duplicate_of").
+
+    Returns:
+        list: plan extended with an entry per duplicate, marked with the same key.
+    """
+    folders = {item["src_path"]: os.path.dirname(item["dst_path"]) for item in plan}
+    used_dst = {item["dst_path"] for item in plan}
+    extended = list(plan)
+    for summary in duplicates:
+        src_path = summary["file_path"]
+        original_key = "duplicate_of" if summary.get("duplicate_of") else "near_duplicate_of"
+        original = summary[original_key]
+        if original not in folders:
+            dst_path = src_path
+        else:
+            stem, ext = os.path.splitext(os.path.basename(src_path))
+            dst_path = os.path.join(folders[original], stem + ext)
+            counter = 1
+            while dst_path in used_dst:
+                dst_path = os.path.join(folders[original], f"{stem}_{counter}{ext}")
+                counter += 1
+        used_dst.add(dst_path)
+        extended.append({
+            "src_path": src_path,
+            "summary": summary["summary"],
+            "dst_path": dst_path,
+            original_key: original
+        })
+    return extended
@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+from modules.ollama_client import (
+    OllamaClient, normalize_base_url, DEFAULT_BASE_URL, DEFAULT_TIMEOUT, DEFAULT_MAX_RETRIES,
+    DEFAULT_BACKOFF_SECONDS, DEFAULT_MAX_IN_FLIGHT
+)
+
+logger = logging.getLogger(__name__)
+
+# Comma separated Ollama endpoints, e.g. "http://gpu1:11434,http://gpu2:11434". Falls back to OLLAMA_HOST.
+HOSTS_ENV = "OLLAMA_HOSTS"
+
+HEALTH_CHECK_INTERVAL = 15.0
+HEALTH_CHECK_TIMEOUT = (2, 5)
+# An endpoint that already has the model loaded is preferred unless it has this many more
+# requests outstanding than the least busy endpoint
+AFFINITY_SLACK = 2
+
+
+def configured_hosts():
+    hosts = [normalize_base_url(host) for host in os.environ.get(HOSTS_ENV, "").split(",") if host.strip()]
+    return hosts or [DEFAULT_BASE_URL]
+
+
+def model_key(name):
+    # Ollama lists "llama3.2:latest" for a request naming "llama3.2"
+    return name if ":" in name else name + ":latest"
+
+
+class Endpoint:
+    """
+    One Ollama instance with its outstanding request count and what its last health check found.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.outstanding = 0
+        self.healthy = True
+        # None until a health check has listed them; then the models installed and currently loaded
+        self.available = None
+        self.loaded = set()
+
+    @property
+    def url(self):
+        return self.client.base_url
+
+    def serves(self, model):
+        return self.available is None or model_key(model) in self.available
+
+    def refresh(self):
+        """
+        Updates health, installed models (/api/tags) and loaded models (/api/ps).
+        """
+        try:
+            tags = self.client.get("/api/tags", timeout=HEALTH_CHECK_TIMEOUT)
+            ps = self.client.get("/api/ps", timeout=HEALTH_CHECK_TIMEOUT)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if self.healthy:
+                logger.warning("Ollama endpoint %s is unhealthy: %s", self.url, e)
+            self.healthy = False
+            return
+        if not self.healthy:
+            logger.info("Ollama endpoint %s is healthy again", self.url)
+        self.healthy = True
+        self.available = {model_key(model["name"]) for model in tags.get("models", [])}
+        self.loaded = {model_key(model["name"]) for model in ps.get("models", [])}
+
+
+class Dispatcher:
+    """
+    Routes Ollama requests across several endpoints.
+
+    Each request goes to the healthy endpoint with the fewest outstanding requests among those
+    that have the model installed, preferring endpoints that already have the model loaded so
+    that models are not swapped in and out of GPU memory. Failed requests are retried on another
+    endpoint. It has the same generate, generate_stream and embed methods as OllamaClient.
+    """
+
+    def __init__(self, hosts=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL):
+        # Retries are made by the dispatcher so that they can move to another endpoint
+        self.endpoints = [
+            Endpoint(OllamaClient(host, timeout=timeout, max_retries=0, backoff_seconds=backoff_seconds,
+                                  max_in_flight=max_in_flight))
+            for host in (hosts or configured_hosts())
+        ]
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        # A single endpoint has nowhere else to go, so it is not health checked
+        if len(self.endpoints) > 1 and health_check_interval:
+            for endpoint in self.endpoints:
+                endpoint.refresh()
+            self._health_thread = threading.Thread(
+                target=self._check_health, args=(health_check_interval,), daemon=True
+            )
+            self._health_thread.start()
+
+    def _check_health(self, interval):
+        while not self._stop.wait(interval):
+            for endpoint in self.endpoints:
+                endpoint.refresh()
+
+    def choose(self, model, exclude=()):
+        """
+        Picks the endpoint for a request to model and counts the request as outstanding.
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and e.serves(model) and e not in exclude]
+            if not candidates:
+                # Better to try an endpoint that looked unhealthy than to fail without trying
+                candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+            least = min(e.outstanding for e in candidates)
+            warm = [e for e in candidates if model_key(model) in e.loaded and e.outstanding <= least + AFFINITY_SLACK]
+            pool = warm or candidates
+            fewest = min(e.outstanding for e in pool)
+            endpoint = random.choice([e for e in pool if e.outstanding == fewest])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, model, ok):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.loaded.add(model_key(model))
+
+    def mark_failed(self, endpoint, error):
+        logger.warning("Ollama request to %s failed (%s)", endpoint.url, error)
+        if len(self.endpoints) > 1 and not isinstance(error, requests.exceptions.HTTPError):
+            # Connection problems take the endpoint out until the next health check succeeds
+            endpoint.healthy = False
+
+    @staticmethod
+    def retryable(error):
+        if isinstance(error, requests.exceptions.HTTPError):
+            return error.response is not None and error.response.status_code >= 500
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def _call(self, model, request):
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.choose(model, tried)
+            ok = False
+            try:
+                result = request(endpoint.client)
+                ok = True
+                return result
+            except requests.exceptions.RequestException as e:
+                if not self.retryable(e) or attempt == self.max_retries:
+                    raise
+                self.mark_failed(endpoint, e)
+                tried.append(endpoint)
+                if len(tried) == len(self.endpoints):
+                    tried = []
+            finally:
+                self.release(endpoint, model, ok)
+            time.sleep(endpoint.client.backoff(attempt))
+
+    def generate(self, payload, timeout=None, url=None):
+        return self._call(payload.get("model", ""), lambda client: client.generate(payload, timeout, url))
+
+    def embed(self, payload, timeout=None, url=None):
+        return self._call(payload.get("model", ""), lambda client: client.embed(payload, timeout, url))
+
+    def generate_stream(self, payload, timeout=None, url=None):
+        """
+        Streams a generate request. It is retried on another endpoint only until the first chunk arrives.
+        """
+        model = payload.get("model", "")
+        tried = []
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.choose(model, tried)
+            chunks = endpoint.client.generate_stream(payload, timeout, url)
+            try:
+                first = next(chunks)
+            except StopIteration:
+                self.release(endpoint, model, True)
+                return
+            except requests.exceptions.RequestException as e:
+                self.release(endpoint, model, False)
+                if not self.retryable(e) or attempt == self.max_retries:
+                    raise
+                self.mark_failed(endpoint, e)
+                tried.append(endpoint)
+                if len(tried) == len(self.endpoints):
+                    tried = []
+                time.sleep(endpoint.client.backoff(attempt))
+                continue
+            except BaseException:
+                self.release(endpoint, model, False)
+                raise
+
+            try:
+                yield first
+                yield from chunks
+            finally:
+                chunks.close()
+                self.release(endpoint, model, True)
+            return
+
+    def stats(self):
+        with self._lock:
+            return [
+                {"url": e.url, "healthy": e.healthy, "outstanding": e.outstanding, "loaded": sorted(e.loaded)}
+                for e in self.endpoints
+            ]
+
+    def close(self):
+        self._stop.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+
+_default_dispatcher = None
+_default_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Returns the process-wide dispatcher over the endpoints in OLLAMA_HOSTS (or OLLAMA_HOST).
+    """
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = Dispatcher()
+        return _default_dispatcher
@@ -0,0 +1,182 @@
+import os
+import json
+from modules.scanner import list_visible_files_recursive, scan_changes, commit_manifest
+from modules.pipeline import process_files
+from modules.tree_structure import generate_tree_structure
+from modules.clustering import generate_tree_by_clustering
+from modules.dedup import attach_duplicates
+from modules.metrics import get_metrics
+from modules.checkpoint import RunCheckpoint, checkpoint_path_for, load_checkpoint, split_checkpoint
+
+TREE_MODES = ("llm", "cluster")
+
+
+def list_target_files(directory, changed_only=False):
+    """
+    Lists the files to sort, either every visible file or only those added or changed since the last scan.
+
+    The whole list is built before processing starts, since duplicate detection and the run
+    checkpoint both need every file up front. With changed_only, commit_scan must be called once
+    the run has succeeded.
+    """
+    if changed_only:
+        return [change["file_path"] for change in scan_changes(directory) if change["status"] != "deleted"]
+    return list_visible_files_recursive(directory)
+
+
+def commit_scan(directory, file_paths, error_files):
+    """
+    Records the files of a successful run in the scan manifest of directory. Files that failed are
+    left out so that the next changed-only run processes them again.
+    """
+    failed = {error_file.get("file_path") for error_file in error_files}
+    commit_manifest(directory, [file_path for file_path in file_paths if file_path not in failed])
+
+
+def summarize_files(file_paths, read_workers=None, model_concurrency=None, use_cache=True, on_result=None,
+                    on_partial=None, on_idle=None, poll_interval=0.5, dedup=True, checkpoint=None):
+    """
+    Summarizes file_paths with the concurrent pipeline.
+
+    Args:
+        on_result (callable): Called as on_result(done, total, file_path, result) after every file,
+            e.g. to update a progress bar.
+        on_partial (callable): Called from worker threads as on_partial(file_path, partial_summary)
+            while summaries stream in.
+        on_idle (callable): Called from the calling thread every poll_interval seconds without a
+            completed file, e.g. to show the partial summaries.
+        dedup (bool): Whether to summarize duplicate files only once.
+        checkpoint (RunCheckpoint): Records every result as soon as it is available.
+
+    Returns:
+        tuple: (summaries, error_files)
+    """
+    summaries, error_files = [], []
+    total = len(file_paths)
+    done = 0
+    for file_path, result in process_files(
+        file_paths, read_workers=read_workers, model_concurrency=model_concurrency, use_cache=use_cache,
+        on_partial=on_partial, poll_interval=poll_interval if on_idle else None, dedup=dedup
+    ):
+        if file_path is None:
+            on_idle()
+            continue
+        done += 1
+        if checkpoint is not None:
+            checkpoint.record_result(file_path, result)
+        if result is not None:
+            if result.get("error"):
+                error_files.append(result)
+            else:
+                summaries.append(result)
+        if on_result:
+            on_result(done, total, file_path, result)
+    return summaries, error_files
+
+
+def generate_plan(summaries, mode="llm", checkpoint=None):
+    """
+    Proposes a destination for every summarized file.
+
+    Duplicates are left out of the tree generation and placed next to the file they duplicate.
+
+    Returns:
+        list: Dictionaries with "src_path", "summary" and "dst_path" (relative to the sorted directory),
+            plus "duplicate_of" or "near_duplicate_of" for duplicates.
+    """
+    unique = [s for s in summaries if not s.get("duplicate_of") and not s.get("near_duplicate_of")]
+    duplicates = [s for s in summaries if s.get("duplicate_of") or s.get("near_duplicate_of")]
+    with get_metrics().timer("tree"):
+        if mode == "cluster":
+            plan = generate_tree_by_clustering(unique)
+        else:
+            plan = generate_tree_structure(unique)
+    if not plan:
+        return []
+    plan = attach_duplicates(plan, duplicates)
+    if checkpoint is not None:
+        checkpoint.record_plan(plan, mode)
+    return plan
+
+
+def resolve_plan(plan, directory):
+    """
+    Returns a copy of plan whose dst_path entries are absolute paths under directory.
+
+    Files that stay where they are have their src_path as dst_path, so the plan must come from a
+    run over the absolute path of directory for those to be left unchanged.
+    """
+    directory = os.path.abspath(directory)
+    return [dict(item, dst_path=os.path.join(directory, item["dst_path"])) for item in plan]
+
+
+def write_plan_jsonl(plan, f):
+    for item in plan:
+        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def read_plan_jsonl(f):
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def run(directory, read_workers=None, model_concurrency=None, use_cache=True, changed_only=False,
+        mode="llm", on_result=None, dedup=True, resume=False, checkpoint_path=None):
+    """
+    Runs scan -> read -> summarize -> tree for directory without touching any file.
+
+    Progress is checkpointed to checkpoint_path (by default a run-state file per directory).
+    With resume, the files listed by the interrupted run are picked up where it stopped instead
+    of scanning the directory again. With changed_only, the scan manifest is updated only once a
+    plan has been generated.
+
+    Returns:
+        tuple: (plan, error_files) where plan is resolved to absolute destination paths.
+    """
+    # Source paths are absolute so that files which stay in place resolve to themselves
+    directory = os.path.abspath(directory)
+    checkpoint_path = checkpoint_path or checkpoint_path_for(directory)
+    state = load_checkpoint(checkpoint_path) if resume else None
+    if state is None:
+        file_paths = list_target_files(directory, changed_only)
+        checkpoint = RunCheckpoint(checkpoint_path, file_paths, directory, mode)
+        done = []
+    else:
+        done, file_paths = split_checkpoint(state)
+        checkpoint = RunCheckpoint(checkpoint_path)
+
+    try:
+        summaries, error_files = summarize_files(
+            file_paths, read_workers=read_workers, model_concurrency=model_concurrency,
+            use_cache=use_cache, on_result=on_result, dedup=dedup, checkpoint=checkpoint
+        )
+        summaries = done + summaries
+        if state is not None and not file_paths and state["plan"] and state["plan_mode"] == mode:
+            plan = state["plan"]
+        else:
+            plan = generate_plan(summaries, mode, checkpoint) if summaries else []
+    finally:
+        checkpoint.close()
+    if changed_only and (plan or not summaries):
+        commit_scan(directory, state["file_paths"] if state is not None else file_paths, error_files)
+    return resolve_plan(plan, directory), error_files
+
+
+def regenerate_plan(directory, mode="llm", checkpoint_path=None):
+    """
+    Generates the tree again from the summaries checkpointed for directory, without summarizing anything.
+
+    Returns:
+        tuple: (plan, remaining) where plan is relative to directory and remaining lists the files
+            the checkpointed run did not finish, or (None, None) if there is no checkpoint.
+    """
+    checkpoint_path = checkpoint_path or checkpoint_path_for(directory)
+    state = load_checkpoint(checkpoint_path)
+    if state is None:
+        return None, None
+    summaries, remaining = split_checkpoint(state)
+    checkpoint = RunCheckpoint(checkpoint_path)
+    try:
+        plan = generate_plan(summaries, mode, checkpoint) if summaries else []
+    finally:
+        checkpoint.close()
+    return plan, remaining
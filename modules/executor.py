@@ -0,0 +1,287 @@
+import os
+import glob
+import json
+import time
+import shutil
+import tempfile
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_COPY_WORKERS = 4
+JOURNAL_DIR_NAME = ".ml_auto_sorting_journals"
+
+_journal_sequence = itertools.count()
+
+
+def journal_path_for(directory):
+    """
+    Returns a new journal path inside directory for the next plan to apply.
+
+    The file is created empty to reserve its name, so journals started within the same second
+    never share a file.
+    """
+    journal_dir = os.path.join(directory, JOURNAL_DIR_NAME)
+    os.makedirs(journal_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S") + f"_{os.getpid()}"
+    while True:
+        journal_path = os.path.join(journal_dir, f"{stamp}_{next(_journal_sequence):06d}.jsonl")
+        try:
+            open(journal_path, 'x').close()
+        except FileExistsError:
+            continue
+        return journal_path
+
+
+def latest_journal(directory):
+    journal_dir = os.path.join(directory, JOURNAL_DIR_NAME)
+    if not os.path.isdir(journal_dir):
+        return None
+    journals = sorted(name for name in os.listdir(journal_dir) if name.endswith(".jsonl"))
+    return os.path.join(journal_dir, journals[-1]) if journals else None
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of a plan.
+
+    The plan is written first, and every move is recorded as "begin" before it starts and
+    "done" once it is durable, so an interrupted run can be resumed or rolled back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path):
+    """
+    Returns (plan, state) from a journal, where state maps each src_path to the last
+    recorded status ("begin", "done", "undone" or "error").
+    """
+    plan, state = [], {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # A torn last line from a crash
+            if record["type"] == "plan":
+                plan = record["items"]
+            else:
+                state[record["src_path"]] = record["type"]
+    return plan, state
+
+
+def device_of(path):
+    """
+    Returns the device id of path, or of its nearest existing ancestor if it does not exist yet.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev
+
+
+def partial_copies(dst):
+    """
+    Returns the temporary files left by interrupted copies to dst.
+    """
+    dst_dir, name = os.path.split(dst)
+    return glob.glob(os.path.join(glob.escape(dst_dir), "." + glob.escape(name) + ".*.partial"))
+
+
+def copy_across_devices(src, dst):
+    # Copy to a temporary name of its own and fsync it first, so dst never holds a partial file
+    fd, tmp_dst = tempfile.mkstemp(dir=os.path.dirname(dst), prefix="." + os.path.basename(dst) + ".", suffix=".partial")
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmp_dst)
+        with open(tmp_dst, 'rb') as f:
+            os.fsync(f.fileno())
+        try:
+            # Unlike os.rename, os.link fails instead of replacing a file that appeared at dst meanwhile
+            os.link(tmp_dst, dst)
+        except FileExistsError:
+            raise
+        except OSError:
+            # Filesystems without hard links (e.g. FAT) fall back to a checked rename
+            if os.path.exists(dst):
+                raise FileExistsError(f"destination already exists: {dst}")
+            os.rename(tmp_dst, dst)
+    finally:
+        if os.path.exists(tmp_dst):
+            os.remove(tmp_dst)
+    os.remove(src)
+
+
+def move(src, dst, journal, copy_pool):
+    """
+    Moves src to dst and journals the move.
+
+    Returns:
+        Future or None: The pending copy for cross-device moves, None for renames.
+    """
+    journal.write({"type": "begin", "src_path": src, "dst_path": dst})
+    if device_of(src) == device_of(os.path.dirname(dst)):
+        os.rename(src, dst)
+        journal.write({"type": "done", "src_path": src, "dst_path": dst})
+        return None
+
+    def copy():
+        copy_across_devices(src, dst)
+        journal.write({"type": "done", "src_path": src, "dst_path": dst})
+
+    return copy_pool.submit(copy)
+
+
+def _run_moves(moves, journal, copy_workers, record_error):
+    """
+    Runs (src, dst) moves, creating each destination directory once.
+
+    A destination is only used by the first move that names it, since a copy to it may still be
+    running when a later move checks whether it exists.
+    """
+    created_dirs = set()
+    claimed = set()
+    futures = {}
+    with ThreadPoolExecutor(max_workers=copy_workers) as copy_pool:
+        for src, dst in moves:
+            try:
+                dst_dir = os.path.dirname(dst)
+                if dst_dir not in created_dirs:
+                    os.makedirs(dst_dir, exist_ok=True)
+                    created_dirs.add(dst_dir)
+                if os.path.abspath(dst) in claimed:
+                    raise FileExistsError(f"destination used by another file of the plan: {dst}")
+                if os.path.exists(dst):
+                    raise FileExistsError(f"destination already exists: {dst}")
+                claimed.add(os.path.abspath(dst))
+                future = move(src, dst, journal, copy_pool)
+                if future is not None:
+                    futures[future] = (src, dst)
+            except OSError as e:
+                record_error(src, dst, e)
+        for future, (src, dst) in futures.items():
+            try:
+                future.result()
+            except OSError as e:
+                record_error(src, dst, e)
+
+
+def apply_plan(plan, journal_path, copy_workers=DEFAULT_COPY_WORKERS, resume=False):
+    """
+    Moves every file of a resolved plan, recording each move in a write-ahead journal.
+
+    Moves within a filesystem use os.rename, while moves across devices are copied and
+    fsynced in parallel. Existing files are never overwritten.
+
+    Args:
+        plan (list): Dictionaries with absolute "src_path" and "dst_path".
+        journal_path (str): Journal file to write.
+        copy_workers (int): Parallel copies for cross-device moves.
+        resume (bool): Continue the plan recorded in an existing journal, skipping finished moves.
+
+    Returns:
+        list: Dictionaries with "src_path", "dst_path" and "status" ("moved", "skipped" or "error"),
+            plus "error_msg" on failure.
+    """
+    state = {}
+    if resume and os.path.exists(journal_path):
+        plan, state = read_journal(journal_path)
+
+    journal = Journal(journal_path)
+    results = {}
+
+    def record_error(src, dst, e):
+        journal.write({"type": "error", "src_path": src, "dst_path": dst, "error_msg": str(e)})
+        results[src] = {"src_path": src, "dst_path": dst, "status": "error", "error_msg": str(e)}
+
+    try:
+        if not state:
+            journal.write({"type": "plan", "items": [{"src_path": i["src_path"], "dst_path": i["dst_path"]} for i in plan]})
+
+        moves = []
+        for item in plan:
+            src, dst = item["src_path"], item["dst_path"]
+            if os.path.abspath(src) == os.path.abspath(dst) or state.get(src) in ("done", "undone"):
+                results[src] = {"src_path": src, "dst_path": dst, "status": "skipped"}
+            elif state.get(src) == "begin" and not os.path.exists(src) and os.path.exists(dst):
+                # The move finished but the crash happened before it was journaled
+                journal.write({"type": "done", "src_path": src, "dst_path": dst})
+                results[src] = {"src_path": src, "dst_path": dst, "status": "moved"}
+            else:
+                if state.get(src) == "begin":
+                    for partial_copy in partial_copies(dst):
+                        os.remove(partial_copy)
+                moves.append((src, dst))
+
+        _run_moves(moves, journal, copy_workers, record_error)
+        for src, dst in moves:
+            results.setdefault(src, {"src_path": src, "dst_path": dst, "status": "moved"})
+    finally:
+        journal.close()
+
+    return [results[item["src_path"]] for item in plan]
+
+
+def undo_plan(journal_path, copy_workers=DEFAULT_COPY_WORKERS):
+    """
+    Rolls back every finished move recorded in a journal by moving the files back.
+
+    Returns:
+        list: Dictionaries with "src_path", "dst_path" and "status" ("restored" or "error").
+    """
+    plan, state = read_journal(journal_path)
+    journal = Journal(journal_path)
+    results = []
+    try:
+        # Move back in reverse order so that later moves are undone first
+        moves = []
+        for item in reversed(plan):
+            src, dst = item["src_path"], item["dst_path"]
+            if state.get(src) == "done" or (state.get(src) == "begin" and os.path.exists(dst) and not os.path.exists(src)):
+                moves.append((dst, src))
+
+        errors = {}
+
+        def record_error(moved_src, moved_dst, e):
+            errors[moved_dst] = str(e)
+
+        undo_journal = _UndoJournal(journal)
+        _run_moves(moves, undo_journal, copy_workers, record_error)
+        for dst, src in moves:
+            if src in errors:
+                results.append({"src_path": src, "dst_path": dst, "status": "error", "error_msg": errors[src]})
+            else:
+                results.append({"src_path": src, "dst_path": dst, "status": "restored"})
+    finally:
+        journal.close()
+    return results
+
+
+class _UndoJournal:
+    """
+    Records moves made while undoing a plan as "undone" entries of the original journal.
+    """
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def write(self, record):
+        if record["type"] == "done":
+            # Undo moves run from the plan's dst_path back to its src_path
+            self.journal.write({"type": "undone", "src_path": record["dst_path"], "dst_path": record["src_path"]})
@@ -1,110 +1,347 @@
 import os
+import base64
+import zipfile
+from io import BytesIO
+from collections import namedtuple
+from PIL import Image
 from PyPDF2 import PdfReader
 from docx import Document
 import csv
 import pandas as pd
 from pptx import Presentation
 from xml.etree import ElementTree as ET
+from modules.cache import file_digest, DEFAULT_CACHE_PATH
 
-def read_pdf(file_path):
+# Readers stop extracting once this many characters have been collected,
+# since only the beginning of each file is sent to the LLM
+DEFAULT_MAX_CHARS = 5000
+DEFAULT_MAX_PAGES = 50
+
+# Rows shown per spreadsheet or CSV, after the column headers
+SAMPLE_ROWS = 5
+
+# Images are downscaled to the vision model's input resolution before they are encoded
+IMAGE_INPUT_SIZE = 378
+IMAGE_JPEG_QUALITY = 85
+THUMBNAIL_CACHE_DIR = os.environ.get(
+    "ML_AUTO_SORTING_THUMBNAILS", os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), "thumbnails")
+)
+
+
+class TextBudget:
+    """
+    Collects text fragments until max_chars characters have been gathered.
+    """
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def add(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self):
+        return "".join(self.parts)[:self.max_chars]
+
+
+def pdf_outline_titles(outline, budget):
+    # Bookmarks are nested lists of destinations, one list level per heading level
+    for entry in outline:
+        if budget.full:
+            return
+        if isinstance(entry, list):
+            pdf_outline_titles(entry, budget)
+        elif getattr(entry, "title", None):
+            budget.add(entry.title + "\n")
+
+def read_pdf(file_path, max_chars=DEFAULT_MAX_CHARS, max_pages=DEFAULT_MAX_PAGES):
     try:
         reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
+        outline = TextBudget(max_chars)
+        try:
+            pdf_outline_titles(reader.outline, outline)
+        except Exception:
+            pass  # A broken outline should not prevent reading the pages
+        # The first page (title, abstract) comes first, followed by as many pages as fit
+        budget = TextBudget(max_chars)
+        for page_number, page in enumerate(reader.pages):
+            if budget.full or page_number >= max_pages:
+                break
             extracted_text = page.extract_text()
             if extracted_text:
-                text += extracted_text
-        return {"text": text, "file_name": os.path.basename(file_path), "file_path": file_path}
+                budget.add(extracted_text)
+        return {"text": budget.text(), "outline": outline.text().strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading PDF: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_doc(file_path):
+def read_doc(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
         doc = Document(file_path)
-        text = "\n".join([p.text for p in doc.paragraphs])
-        return {"text": text, "file_name": os.path.basename(file_path), "file_path": file_path}
+        budget = TextBudget(max_chars)
+        headings = TextBudget(max_chars)
+        for p in doc.paragraphs:
+            if budget.full and headings.full:
+                break
+            style_name = p.style.name if p.style is not None else ""
+            if p.text.strip() and style_name.startswith(("Heading", "Title")) and not headings.full:
+                headings.add(p.text + "\n")
+            if not budget.full:
+                budget.add(p.text + "\n")
+        return {"text": budget.text().rstrip("\n"), "outline": headings.text().strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading Word document: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_py(file_path):
+def read_py(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+            text = f.read(max_chars)
         return {"text": text, "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading Python script: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_txt(file_path):
+def read_txt(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
+            text = f.read(max_chars)
         return {"text": text, "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading text file: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_pptx(file_path):
+def read_pptx(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
         prs = Presentation(file_path)
-        text = ""
-        for slide in prs.slides:
+        budget = TextBudget(max_chars)
+        titles = TextBudget(max_chars)
+        for slide_number, slide in enumerate(prs.slides, start=1):
+            if budget.full and titles.full:
+                break
+            title = slide.shapes.title
+            if title is not None and title.has_text_frame and title.text_frame.text.strip() and not titles.full:
+                titles.add(f"Slide {slide_number}: {' '.join(title.text_frame.text.split())}\n")
+            if budget.full:
+                continue
             for shape in slide.shapes:
                 if shape.has_text_frame:
                     for paragraph in shape.text_frame.paragraphs:
-                        text += " ".join(run.text for run in paragraph.runs) + "\n"
-        return {"text": text.strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
+                        budget.add(" ".join(run.text for run in paragraph.runs) + "\n")
+        return {"text": budget.text().strip(), "outline": titles.text().strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading PowerPoint file: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_excel(file_path):
+def read_excel(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
-        df = pd.read_excel(file_path, sheet_name=None)  # Read all sheets as a dictionary
-        text = ""
+        # The headers and a few sample rows describe a sheet better than a padded dump of it
+        df = pd.read_excel(file_path, sheet_name=None, nrows=SAMPLE_ROWS)  # Read all sheets as a dictionary
+        budget = TextBudget(max_chars)
+        headers = TextBudget(max_chars)
         for sheet_name, sheet_data in df.items():
-            text += f"Sheet: {sheet_name}\n"
-            text += sheet_data.to_string(index=False) + "\n"
-        return {"text": text.strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
+            if budget.full:
+                break
+            headers.add(f"Sheet: {sheet_name} (columns: {', '.join(str(column) for column in sheet_data.columns)})\n")
+            budget.add(f"Sheet: {sheet_name}\n")
+            budget.add(sheet_data.to_csv(index=False))
+        return {"text": budget.text().strip(), "outline": headers.text().strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading Excel file: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_csv(file_path):
+def read_csv(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
+        budget = TextBudget(max_chars)
+        header = ""
         with open(file_path, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            text = "\n".join([", ".join(row) for row in reader])
-        return {"text": text.strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
+            rows = csv.reader(file)
+            for row in rows:
+                header = "Columns: " + ", ".join(row)
+                break
+            for row_number, row in enumerate(rows):
+                if budget.full or row_number >= SAMPLE_ROWS:
+                    break
+                budget.add(", ".join(row) + "\n")
+        return {"text": budget.text().strip(), "outline": header, "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading CSV file: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
-def read_kml(file_path):
+def read_kml(file_path, max_chars=DEFAULT_MAX_CHARS):
     try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-
         # Extract data from the KML namespace
         namespace = {"kml": "http://www.opengis.net/kml/2.2"}
-        text = ""
+        placemark_tag = "{http://www.opengis.net/kml/2.2}Placemark"
+        budget = TextBudget(max_chars)
+
+        # Stream the document so that large KML files are not loaded into memory as a whole
+        for _, element in ET.iterparse(file_path, events=("end",)):
+            if element.tag != placemark_tag:
+                continue
+            name = element.find("kml:name", namespace)
+            description = element.find("kml:description", namespace)
+            coordinates = element.find(".//kml:coordinates", namespace)
 
-        for placemark in root.findall(".//kml:Placemark", namespace):
-            name = placemark.find("kml:name", namespace)
-            description = placemark.find("kml:description", namespace)
-            coordinates = placemark.find(".//kml:coordinates", namespace)
-            
             if name is not None:
-                text += f"Name: {name.text}\n"
+                budget.add(f"Name: {name.text}\n")
             if description is not None:
-                text += f"Description: {description.text}\n"
+                budget.add(f"Description: {description.text}\n")
             if coordinates is not None:
-                text += f"Coordinates: {coordinates.text.strip()}\n"
-            text += "\n"
-        
-        return {"text": text.strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
+                budget.add(f"Coordinates: {coordinates.text.strip()}\n")
+            budget.add("\n")
+            element.clear()
+            if budget.full:
+                break
+
+        return {"text": budget.text().strip(), "file_name": os.path.basename(file_path), "file_path": file_path}
     except Exception as e:
         return {"text": f"Error reading KML: {e}", "file_name": os.path.basename(file_path), "file_path": file_path, "error": True}
 
+def prepare_image(file_path, size=IMAGE_INPUT_SIZE, cache_dir=None):
+    """
+    Downscales an image to fit size x size and returns it as a base64-encoded JPEG.
+    Thumbnails are cached on disk by the content hash of the original image, under cache_dir
+    (THUMBNAIL_CACHE_DIR by default).
+    """
+    cache_dir = cache_dir or THUMBNAIL_CACHE_DIR
+    content_hash = file_digest(file_path)
+    thumbnail_path = os.path.join(cache_dir, content_hash[:2], f"{content_hash}_{size}.jpg")
+    if os.path.exists(thumbnail_path):
+        with open(thumbnail_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode("ascii")
+
+    with Image.open(file_path) as img:
+        # Let the JPEG decoder skip detail we are going to throw away anyway
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+    data = buffer.getvalue()
+
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    tmp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, thumbnail_path)
+    return base64.b64encode(data).decode("ascii")
+
 def read_image(file_path):
     try:
         if not os.path.exists(file_path):
             raise FileNotFoundError("Image file not found.")
-        return {"image_path": file_path, "file_name": os.path.basename(file_path)}
+        return {"image_path": file_path, "file_name": os.path.basename(file_path), "image_b64": prepare_image(file_path)}
     except Exception as e:
         return {"image_path": file_path, "file_name": os.path.basename(file_path), "error": True, "error_msg": str(e)}
+
+
+# Cost classes of readers. Heavy readers are scheduled on a process pool, cheap ones on threads.
+CHEAP = "cheap"
+HEAVY = "heavy"
+
+ReaderSpec = namedtuple("ReaderSpec", ["reader", "cost", "kind"])
+
+# Registered readers keyed by lowercase extension, and by leading magic bytes for files
+# whose extension is missing or unknown
+READERS = {}
+MAGIC_READERS = {}
+
+# Office Open XML documents are all zip archives, told apart by their top-level folder
+ZIP_CONTAINER_EXTENSIONS = {"word/": ".docx", "ppt/": ".pptx", "xl/": ".xlsx"}
+ZIP_MAGIC = b"PK\x03\x04"
+MAGIC_READ_SIZE = 16
+
+
+def register_reader(extensions, reader, cost=CHEAP, kind="text", magic=()):
+    """
+    Registers reader for the given file extensions and magic byte prefixes.
+
+    Args:
+        extensions (tuple): Extensions including the dot, e.g. (".txt",).
+        reader (callable): Takes a file path and returns a dict with "file_name", "file_path"
+            and either "text" or "image_path", plus "error" on failure. Text readers may add an
+            "outline" (headings, slide titles, column headers) that is shown to the model first.
+        cost (str): CHEAP or HEAVY.
+        kind (str): "text" for text summarization or "image" for image summarization.
+        magic (tuple): Byte prefixes that identify the format regardless of the extension.
+    """
+    spec = ReaderSpec(reader, cost, kind)
+    for extension in extensions:
+        READERS[extension.lower()] = spec
+    for prefix in magic:
+        MAGIC_READERS[prefix] = spec
+    return spec
+
+
+def sniff_reader(file_path):
+    """
+    Identifies the reader of a file from its leading bytes.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            head = f.read(MAGIC_READ_SIZE)
+    except OSError:
+        return None
+    if head.startswith(ZIP_MAGIC):
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                for name in archive.namelist():
+                    for folder, extension in ZIP_CONTAINER_EXTENSIONS.items():
+                        if name.startswith(folder):
+                            return READERS.get(extension)
+        except (OSError, zipfile.BadZipFile):
+            return None
+        return None
+    for prefix, spec in MAGIC_READERS.items():
+        if head.startswith(prefix):
+            return spec
+    return None
+
+
+def get_reader(file_path):
+    """
+    Returns the ReaderSpec for a file, or None if the file type is not supported.
+    The extension is looked up first, and the magic bytes are only read for unknown extensions.
+    """
+    spec = READERS.get(os.path.splitext(file_path)[1].lower())
+    if spec is None:
+        spec = sniff_reader(file_path)
+    return spec
+
+
+def read_file(file_path, spec=None):
+    """
+    Reads a file with its registered reader.
+
+    Returns:
+        dict or None: The reader output, or None if the file type is not supported.
+    """
+    spec = spec or get_reader(file_path)
+    if spec is None:
+        return None
+    return spec.reader(file_path)
+
+
+def read_image_file(file_path):
+    # Report image errors in the same shape as the other readers
+    image_data = read_image(file_path)
+    if image_data.get("error"):
+        return {
+            "file_name": image_data.get("file_name"),
+            "file_path": image_data.get("image_path"),
+            "summary": image_data.get("error_msg", "画像の読み込みエラー"),
+            "error": True
+        }
+    return image_data
+
+
+register_reader((".pdf",), read_pdf, cost=HEAVY, magic=(b"%PDF",))
+register_reader((".docx", ".doc"), read_doc, cost=HEAVY)
+register_reader((".py",), read_py)
+register_reader((".txt",), read_txt)
+register_reader((".pptx",), read_pptx, cost=HEAVY)
+register_reader((".xlsx",), read_excel, cost=HEAVY)
+register_reader((".csv",), read_csv)
+register_reader((".kml",), read_kml)
+register_reader((".jpg", ".jpeg"), read_image_file, cost=HEAVY, kind="image", magic=(b"\xff\xd8\xff",))
+register_reader((".png",), read_image_file, cost=HEAVY, kind="image", magic=(b"\x89PNG\r\n\x1a\n",))
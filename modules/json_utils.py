@@ -0,0 +1,147 @@
+import re
+import json
+
+
+class JsonObjectScanner:
+    """
+    Incrementally scans streamed text for the first complete top-level JSON object.
+
+    Text before the opening brace is skipped, and everything after the matching closing
+    brace is ignored, so the stream can be closed as soon as complete is True.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk):
+        """
+        Feeds the next chunk of text and returns True once the object is complete.
+        """
+        if self.complete:
+            return True
+        start = 0
+        for i, char in enumerate(chunk):
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                    start = i
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(chunk[start:i + 1])
+                    self.complete = True
+                    return True
+        if self.started:
+            self.parts.append(chunk[start:])
+        return False
+
+    def text(self):
+        return "".join(self.parts)
+
+    def parse(self):
+        """
+        Returns the decoded object.
+
+        Raises:
+            json.JSONDecodeError: If the object is incomplete or invalid.
+        """
+        return json.loads(self.text())
+
+
+def partial_string_field(text, key):
+    """
+    Returns the (possibly unfinished) value of a string field from partial JSON text,
+    or None if the field has not started yet.
+    """
+    match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % re.escape(key), text, re.DOTALL)
+    if not match:
+        return None
+    value = match.group(1)
+    # Drop a dangling escape so that the value can be decoded
+    if value.endswith("\\") and not value.endswith("\\\\"):
+        value = value[:-1]
+    try:
+        return json.loads(f'"{value}"')
+    except json.JSONDecodeError:
+        return value
+
+
+_CODE_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def parse_json_response(text):
+    """
+    Parses a model response as JSON, repairing common breakage.
+
+    Code fences, prose before or after the object and trailing commas are tolerated.
+
+    Raises:
+        json.JSONDecodeError: If no JSON object can be recovered.
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        error = e
+
+    fenced = _CODE_FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    candidate = scanner.text() if scanner.started else text
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+    raise error
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def validate(value, schema):
+    """
+    Checks value against the subset of JSON Schema used for Ollama's structured outputs
+    (type, properties, required and items).
+    """
+    expected = _JSON_TYPES.get(schema.get("type"))
+    if expected and not isinstance(value, expected):
+        return False
+    if isinstance(value, dict):
+        if any(key not in value for key in schema.get("required", ())):
+            return False
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in value and not validate(value[key], property_schema):
+                return False
+    if isinstance(value, list) and "items" in schema:
+        return all(validate(item, schema["items"]) for item in value)
+    return True
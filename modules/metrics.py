@@ -0,0 +1,171 @@
+import json
+import time
+import heapq
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SLOWEST_FILES = 20
+PROMETHEUS_PREFIX = "ml_auto_sorting"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Metrics:
+    """
+    Collects per-stage timings, input file size and token counters and errors for one run.
+
+    Stages are free-form names such as "scan", "read.pdf", "ollama.llama3.2" or "tree".
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+            self.errors = {}
+            self.counters = {}
+            self._slowest = []
+
+    def observe(self, stage, seconds, file_path=None, file_size=None, error=False):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+            if error:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+            if file_size:
+                # Size of the input files, not what readers consumed, since they may stop early
+                self.counters[f"{stage}.file_size_bytes"] = self.counters.get(f"{stage}.file_size_bytes", 0) + file_size
+            if file_path:
+                entry = (seconds, stage, file_path)
+                if len(self._slowest) < SLOWEST_FILES:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heappushpop(self._slowest, entry)
+
+    def add(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def timer(self, stage, file_path=None, file_size=None):
+        """
+        Times the enclosed block as one observation of stage. Exceptions count as errors.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.observe(stage, time.perf_counter() - start, file_path, file_size, error=True)
+            raise
+        self.observe(stage, time.perf_counter() - start, file_path, file_size)
+
+    def record_ollama(self, model, response):
+        """
+        Adds the token counts and durations that Ollama reports in a final response.
+        """
+        for key in ("prompt_eval_count", "eval_count"):
+            if key in response:
+                self.add(f"ollama.{model}.{key}", response[key])
+        for key in ("prompt_eval_duration", "eval_duration", "load_duration"):
+            if key in response:
+                # Ollama reports durations in nanoseconds
+                self.add(f"ollama.{model}.{key}_seconds", response[key] / 1e9)
+
+    def summary(self):
+        """
+        Returns count, errors, total, p50, p95 and max seconds per stage.
+        """
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            errors = dict(self.errors)
+        return {
+            stage: {
+                "count": len(values),
+                "errors": errors.get(stage, 0),
+                "total_seconds": sum(values),
+                "p50_seconds": percentile(values, 0.5),
+                "p95_seconds": percentile(values, 0.95),
+                "max_seconds": values[-1] if values else None,
+            }
+            for stage, values in sorted(samples.items())
+        }
+
+    def histogram(self, stage):
+        """
+        Returns cumulative bucket counts of stage as [(upper_bound, count), ...] ending with +Inf.
+        """
+        with self._lock:
+            values = sorted(self.samples.get(stage, ()))
+        counts = [(bound, bisect.bisect_right(values, bound)) for bound in self.buckets]
+        counts.append((float("inf"), len(values)))
+        return counts
+
+    def slowest(self, n=SLOWEST_FILES):
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)[:n]
+        return [{"seconds": seconds, "stage": stage, "file_path": file_path} for seconds, stage, file_path in slowest]
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            "stages": self.summary(),
+            "histograms": {stage: [[bound, count] for bound, count in self.histogram(stage)] for stage in self.samples},
+            "counters": counters,
+            "slowest": self.slowest(),
+        }
+
+    def to_json(self):
+        # Infinity is not valid JSON, so the last bucket bound is written as a string
+        data = self.to_dict()
+        for counts in data["histograms"].values():
+            counts[-1][0] = "+Inf"
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Wall time per stage.",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = {stage: list(values) for stage, values in self.samples.items()}
+            errors = dict(self.errors)
+            counters = dict(self.counters)
+        for stage, values in sorted(stages.items()):
+            for bound, count in self.histogram(stage):
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {sum(values)}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {len(values)}')
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_errors_total counter")
+        for stage in sorted(stages):
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_errors_total{{stage="{stage}"}} {errors.get(stage, 0)}')
+
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_counter_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_counter_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """
+    Returns the process-wide metrics of the current run.
+    """
+    return _metrics
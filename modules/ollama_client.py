@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from modules.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 11434
+
+
+def normalize_base_url(url):
+    """
+    Returns url with a scheme. OLLAMA_HOST is documented without one, e.g. "127.0.0.1:11434"
+    or "0.0.0.0", so like Ollama itself a missing scheme means http and a missing port 11434.
+    """
+    url = url.strip().rstrip("/")
+    if "://" in url:
+        return url
+    host = url or "127.0.0.1"
+    if urlsplit("//" + host).port is None:
+        host += f":{DEFAULT_PORT}"
+    return "http://" + host
+
+
+DEFAULT_BASE_URL = normalize_base_url(os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 300)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_MAX_BACKOFF_SECONDS = 10
+
+# Requests in flight at once, to protect a GPU box shared by several users
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class OllamaClient:
+    """
+    Shared client for Ollama's REST API.
+
+    Requests go through one pooled requests.Session so that connections are kept alive
+    between files. Connection errors and 5xx responses are retried with jittered exponential
+    backoff, and at most max_in_flight requests are sent at the same time.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS, max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.base_url = normalize_base_url(base_url)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return path if path.startswith(("http://", "https://")) else self.base_url + path
+
+    def backoff(self, attempt):
+        # Full jitter keeps clients that failed together from retrying together
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    def post(self, path, payload, timeout=None):
+        """
+        Posts payload as JSON and returns the response.
+
+        Raises:
+            requests.exceptions.RequestException: If the request still fails after all retries,
+                or the response has an error status.
+        """
+        url = self.url(path)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._in_flight:
+                    response = self.session.post(url, json=payload, timeout=timeout or self.timeout)
+                if response.status_code < 500 or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning("Ollama returned %s for %s, retrying", response.status_code, url)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Ollama request to %s failed (%s), retrying", url, e)
+            time.sleep(self.backoff(attempt))
+
+    def get(self, path, timeout=None):
+        """
+        Sends a GET request once, without retries, and returns the decoded JSON response.
+        """
+        response = self.session.get(self.url(path), timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def stream(self, path, payload, timeout=None):
+        """
+        Posts payload with streaming enabled and yields the decoded NDJSON chunks.
+
+        Failures are retried only until the first chunk has arrived. Closing the generator
+        closes the connection, so callers can stop reading as soon as they have what they need.
+        """
+        url = self.url(path)
+        for attempt in range(self.max_retries + 1):
+            self._in_flight.acquire()
+            try:
+                response = self.session.post(url, json=payload, timeout=timeout or self.timeout, stream=True)
+                if response.status_code < 500 or attempt == self.max_retries:
+                    response.raise_for_status()
+                    break
+                response.close()
+                logger.warning("Ollama returned %s for %s, retrying", response.status_code, url)
+            except requests.exceptions.HTTPError:
+                response.close()
+                self._in_flight.release()
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries:
+                    self._in_flight.release()
+                    raise
+                logger.warning("Ollama request to %s failed (%s), retrying", url, e)
+            except Exception:
+                self._in_flight.release()
+                raise
+            self._in_flight.release()
+            time.sleep(self.backoff(attempt))
+
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+            self._in_flight.release()
+
+    def generate(self, payload, timeout=None, url=None):
+        """
+        Calls /api/generate (or url) and returns the decoded JSON response.
+        """
+        model = payload.get("model", "")
+        metrics = get_metrics()
+        with metrics.timer(f"ollama.{model}"):
+            data = self.post(url or "/api/generate", payload, timeout).json()
+        metrics.record_ollama(model, data)
+        return data
+
+    def generate_stream(self, payload, timeout=None, url=None):
+        """
+        Calls /api/generate (or url) with "stream": True and yields the response chunks.
+        """
+        model = payload.get("model", "")
+        metrics = get_metrics()
+        start = time.perf_counter()
+        chunks = 0
+        error = False
+        try:
+            for chunk in self.stream(url or "/api/generate", dict(payload, stream=True), timeout):
+                chunks += 1
+                if chunk.get("done"):
+                    metrics.record_ollama(model, chunk)
+                yield chunk
+        except Exception:
+            error = True
+            raise
+        finally:
+            # Streams closed early never receive the final statistics, so count the chunks instead
+            metrics.add(f"ollama.{model}.streamed_chunks", chunks)
+            metrics.observe(f"ollama.{model}", time.perf_counter() - start, error=error)
+
+    def embed(self, payload, timeout=None, url=None):
+        with get_metrics().timer(f"ollama.{payload.get('model', '')}"):
+            return self.post(url or "/api/embed", payload, timeout).json()
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,289 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from modules.file_readers import get_reader, read_file, HEAVY
+from modules.dedup import group_exact_duplicates, simhash, NearDuplicateIndex
+from modules.metrics import get_metrics
+from modules.dispatcher import get_dispatcher
+from modules.summarization import (
+    summarize_with_ollama, summarize_image_with_moondream, lookup_cached_summary,
+    SUMMARY_MODEL, IMAGE_MODEL, SUMMARY_PROMPT_VERSION, IMAGE_PROMPT_VERSION
+)
+
+# Maximum number of concurrent requests per model and Ollama endpoint. Models not listed here use
+# DEFAULT_MODEL_CONCURRENCY.
+MODEL_CONCURRENCY = {
+    SUMMARY_MODEL: 4,
+    IMAGE_MODEL: 2,
+}
+DEFAULT_MODEL_CONCURRENCY = 2
+
+# Threads used for cheap readers such as plain text and CSV, and for summary cache lookups
+CHEAP_READ_WORKERS = 8
+
+# Modules imported once by the fork server, so that each reader process starts without re-importing them
+READER_PRELOAD = ["modules.file_readers"]
+
+
+def reader_process_context():
+    """
+    Returns the multiprocessing context of the heavy reader pool.
+
+    A plain fork copies the locks held by the parent's threads at that moment (summary cache,
+    metrics, logging) into the child, where nothing ever releases them, so readers are started
+    from a fork server (or spawned where there is none) instead.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(READER_PRELOAD)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def lookup_file(file_path, spec):
+    """
+    Hashes a file and looks up its summary in the summary cache. Runs in the parent process.
+
+    Returns:
+        tuple: (content_hash, cached summary marked with "cached": True, or None)
+    """
+    if spec.kind == "image":
+        model, prompt_version = IMAGE_MODEL, IMAGE_PROMPT_VERSION
+    else:
+        model, prompt_version = SUMMARY_MODEL, SUMMARY_PROMPT_VERSION
+    file_info = {"file_path": file_path, "file_name": os.path.basename(file_path)}
+    with get_metrics().timer("cache_lookup"):
+        content_hash, cached = lookup_cached_summary(file_info, model, prompt_version)
+    if cached is not None:
+        cached["cached"] = True
+    return content_hash, cached
+
+
+def load_file(file_path, spec, content_hash=None):
+    """
+    Reads a file with its reader. The "content_hash" found by lookup_file is attached so that
+    the summarizer does not hash the file a second time.
+
+    Since this may run in another process, its timing is returned in "read_metrics" for the
+    caller to record.
+    """
+    start = time.perf_counter()
+    file_data = read_file(file_path, spec)
+    if file_data is not None and not file_data.get("error") and content_hash is not None:
+        file_data["content_hash"] = content_hash
+    if file_data is not None:
+        try:
+            file_size = os.path.getsize(file_path)
+        except OSError:
+            file_size = None
+        file_data["read_metrics"] = {
+            "stage": "read" + os.path.splitext(file_path)[1].lower(),
+            "seconds": time.perf_counter() - start,
+            "file_size": file_size
+        }
+    return file_data
+
+
+def summarize_file(file_data, use_cache=True, on_partial=None):
+    """
+    Summarizes the output of a reader with the model suited to its type.
+    on_partial is called as on_partial(file_path, partial_summary) while a text summary streams in.
+    """
+    file_path = file_data.get("file_path")
+    with get_metrics().timer("summarize", file_path):
+        if "image_path" in file_data:
+            return summarize_image_with_moondream(file_data, use_cache=use_cache)
+        partial_callback = (lambda partial: on_partial(file_path, partial)) if on_partial else None
+        return summarize_with_ollama(file_data, use_cache=use_cache, on_partial=partial_callback)
+
+
+def model_for(file_data):
+    return IMAGE_MODEL if "image_path" in file_data else SUMMARY_MODEL
+
+
+def as_duplicate(result, file_path, original_key, original):
+    """
+    Returns a copy of the result of original for its duplicate file_path.
+    """
+    return dict(result, file_path=file_path, file_name=os.path.basename(file_path), **{original_key: original})
+
+
+def process_files(file_paths, read_workers=None, model_concurrency=None, use_cache=True,
+                  on_partial=None, poll_interval=None, dedup=True):
+    """
+    Reads and summarizes files concurrently, yielding results in completion order.
+
+    Readers are looked up in the reader registry. Heavy readers run in a process pool and
+    cheap ones in a thread pool, while LLM requests run in a separate thread pool per model
+    so that each model's concurrency can be tuned independently. Files whose
+    summary is already in the summary cache are neither read nor sent to the LLM.
+
+    With dedup enabled, only one file of each group of identical files is read and summarized,
+    and files whose extracted text is nearly identical to one already being summarized share
+    its summary. Their results are marked with "duplicate_of" or "near_duplicate_of".
+
+    Args:
+        file_paths (list): Paths of the files to process.
+        read_workers (int): Number of processes for heavy readers. Defaults to the CPU count.
+        model_concurrency (dict): Overrides for the total concurrency of a model, keyed by model name.
+            Defaults to MODEL_CONCURRENCY times the number of configured endpoints.
+        use_cache (bool): Whether to reuse and store summaries in the summary cache.
+        on_partial (callable): Called from worker threads as on_partial(file_path, partial_summary)
+            while summaries stream in.
+        poll_interval (float): If set, (None, None) is yielded whenever nothing has completed for
+            this many seconds, so that callers can refresh their display.
+        dedup (bool): Whether to summarize duplicate files only once.
+
+    Yields:
+        tuple: (file_path, result) where result is the summary dict (with "error" set on failure),
+            or None if the file type is not supported.
+    """
+    hosts = len(get_dispatcher().endpoints)
+    limits = {model: limit * hosts for model, limit in MODEL_CONCURRENCY.items()}
+    if model_concurrency:
+        limits.update(model_concurrency)
+
+    llm_pools = {}
+    pools_lock = threading.Lock()
+
+    def llm_pool(model):
+        with pools_lock:
+            if model not in llm_pools:
+                llm_pools[model] = ThreadPoolExecutor(
+                    max_workers=limits.get(model, DEFAULT_MODEL_CONCURRENCY * hosts),
+                    thread_name_prefix=f"llm-{model}"
+                )
+            return llm_pools[model]
+
+    heavy_read_pool = ProcessPoolExecutor(max_workers=read_workers or os.cpu_count(), mp_context=reader_process_context())
+    cheap_read_pool = ThreadPoolExecutor(max_workers=CHEAP_READ_WORKERS, thread_name_prefix="read")
+    try:
+        duplicates = {}
+        if dedup:
+            file_paths = list(file_paths)
+            duplicates = group_exact_duplicates(file_paths)
+            skipped = {member for members in duplicates.values() for member in members}
+            file_paths = [file_path for file_path in file_paths if file_path not in skipped]
+        # (file_path, file_data) of the near-duplicates waiting for the summary of each original
+        near_duplicates = {}
+        near_duplicate_index = NearDuplicateIndex()
+        # Results of files in near_duplicate_index, for near-duplicates found after they finished
+        indexed_results = {}
+        # Originals whose summary failed; their near-duplicates are summarized on their own
+        failed = set()
+
+        def with_duplicates(file_path, result, root=None):
+            # Copies point at the file that gets a place in the tree, which a near-duplicate does not
+            root = root or file_path
+            yield file_path, result
+            if result is None:
+                # Copies of an unsupported file are unsupported as well
+                for member in duplicates.get(file_path, ()):
+                    yield member, None
+                return
+            for member in duplicates.get(file_path, ()):
+                yield member, as_duplicate(result, member, "duplicate_of", root)
+            for member, _ in near_duplicates.pop(file_path, ()):
+                yield from with_duplicates(member, as_duplicate(result, member, "near_duplicate_of", file_path), root)
+
+        pending = {}
+        specs = {}
+
+        def submit_read(file_path, content_hash=None):
+            spec = specs[file_path]
+            read_pool = heavy_read_pool if spec.cost == HEAVY else cheap_read_pool
+            pending[read_pool.submit(load_file, file_path, spec, content_hash)] = ("read", file_path)
+
+        def submit_summary(file_path, file_data):
+            # Hand the file content over to the LLM pool of the matching model
+            summary_future = llm_pool(model_for(file_data)).submit(summarize_file, file_data, use_cache, on_partial)
+            pending[summary_future] = ("summarize", file_path)
+
+        def finish_summary(file_path, result):
+            if dedup and result.get("error"):
+                failed.add(file_path)
+                for member, member_data in near_duplicates.pop(file_path, ()):
+                    submit_summary(member, member_data)
+            elif dedup:
+                indexed_results[file_path] = result
+            yield from with_duplicates(file_path, result)
+
+        for file_path in file_paths:
+            spec = get_reader(file_path)
+            if spec is None:
+                yield from with_duplicates(file_path, None)  # Unsupported file type
+                continue
+            specs[file_path] = spec
+            if use_cache:
+                # Hashing and cache lookups stay in this process; reader processes never touch the cache
+                pending[cheap_read_pool.submit(lookup_file, file_path, spec)] = ("lookup", file_path)
+            else:
+                submit_read(file_path)
+
+        while pending:
+            done, _ = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            if not done:
+                yield None, None
+                continue
+            for future in done:
+                stage, file_path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "summary": f"Error processing file: {e}",
+                        "file_name": os.path.basename(file_path),
+                        "file_path": file_path,
+                        "error": True
+                    }
+                    if stage == "summarize":
+                        yield from finish_summary(file_path, result)
+                    else:
+                        yield from with_duplicates(file_path, result)
+                    continue
+
+                if stage == "lookup":
+                    content_hash, cached = result
+                    if cached is None:
+                        submit_read(file_path, content_hash)
+                    else:
+                        yield from with_duplicates(file_path, cached)
+                    continue
+
+                if stage == "read" and result is not None and "read_metrics" in result:
+                    read_metrics = result.pop("read_metrics")
+                    get_metrics().observe(
+                        read_metrics["stage"], read_metrics["seconds"], file_path,
+                        read_metrics.get("file_size"), error=result.get("error", False)
+                    )
+
+                if stage == "read" and result is not None and not result.get("error"):
+                    if dedup and result.get("text"):
+                        fingerprint = simhash(result["text"])
+                        original = near_duplicate_index.find(fingerprint)
+                        if original in indexed_results:
+                            yield from with_duplicates(
+                                file_path, as_duplicate(indexed_results[original], file_path, "near_duplicate_of", original), original
+                            )
+                            continue
+                        if original is not None and original not in failed:
+                            # The summary of the original is shared once it is ready
+                            near_duplicates.setdefault(original, []).append((file_path, result))
+                            continue
+                        if original is None:
+                            near_duplicate_index.add(fingerprint, file_path)
+
+                    submit_summary(file_path, result)
+                    continue
+
+                if stage == "summarize":
+                    yield from finish_summary(file_path, result)
+                else:
+                    yield from with_duplicates(file_path, result)
+    finally:
+        heavy_read_pool.shutdown(wait=False, cancel_futures=True)
+        cheap_read_pool.shutdown(wait=False, cancel_futures=True)
+        for pool in llm_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
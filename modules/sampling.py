@@ -0,0 +1,76 @@
+# Prompt tokens spent on the content of one file when summarizing it
+SUMMARY_TOKEN_BUDGET = 1200
+# Share of the budget given to the outline (headings, slide titles) when a reader provides one
+OUTLINE_BUDGET_SHARE = 0.3
+
+# Files with less text than this are summarized by their own text instead of asking the LLM
+MIN_SUMMARY_CHARS = 80
+EMPTY_FILE_SUMMARY = "Empty file."
+
+
+def token_cost(char):
+    return 0.25 if ord(char) < 128 else 1
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of tokens in text without loading a tokenizer.
+    ASCII text averages about four characters per token, while CJK text is closer to one.
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Returns the longest prefix of text estimated to fit in max_tokens, cut at a line or word break if possible.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    tokens = 0
+    end = 0
+    for end, char in enumerate(text):
+        tokens += token_cost(char)
+        if tokens >= max_tokens:
+            break
+    cut = text[:end]
+    # Avoid ending in the middle of a line or a word when a break is reasonably close
+    for separator in ("\n", " "):
+        position = cut.rfind(separator)
+        if position > len(cut) * 0.8:
+            return cut[:position]
+    return cut
+
+
+def sample_content(file_data, max_tokens=SUMMARY_TOKEN_BUDGET):
+    """
+    Builds the file content shown to the summary model within max_tokens.
+
+    Readers return the body text in "text" and, for structured formats, an "outline" such as
+    document headings or slide titles. The outline comes first, since it describes the whole
+    file, and the body fills the rest of the budget.
+    """
+    text = file_data.get("text", "").strip()
+    outline = file_data.get("outline", "").strip()
+    if not outline:
+        return truncate_to_tokens(text, max_tokens)
+    outline = truncate_to_tokens(outline, int(max_tokens * OUTLINE_BUDGET_SHARE))
+    sampled = f"Outline:\n{outline}"
+    remaining = max_tokens - estimate_tokens(sampled)
+    if text and remaining > 0:
+        sampled += f"\n\nContent:\n{truncate_to_tokens(text, remaining)}"
+    return sampled
+
+
+def trivial_summary(file_data, min_chars=MIN_SUMMARY_CHARS):
+    """
+    Returns a summary for files too small to be worth an LLM request, or None.
+    """
+    text = " ".join(file_data.get("text", "").split())
+    if file_data.get("outline"):
+        return None
+    if not text:
+        return EMPTY_FILE_SUMMARY
+    if len(text) < min_chars:
+        return text
+    return None
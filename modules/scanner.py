@@ -0,0 +1,117 @@
+import os
+import json
+import time
+from modules.metrics import get_metrics
+
+MANIFEST_NAME = ".ml_auto_sorting_manifest.json"
+
+def iter_visible_files(path):
+    """
+    Yields (file_path, stat_result) for every visible file under path using os.scandir.
+    Hidden files and directories are skipped.
+    """
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue  # Exclude hidden files and dirs
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path, entry.stat()
+        except OSError:
+            continue
+
+def list_visible_files_recursive(path):
+    with get_metrics().timer("scan"):
+        return [file_path for file_path, _ in iter_visible_files(path)]
+
+def manifest_path_for(path):
+    return os.path.join(path, MANIFEST_NAME)
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest_path, manifest):
+    # Write to a temporary file first so that an interrupted write never corrupts the manifest
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def scan_changes(path, manifest_path=None):
+    """
+    Incrementally scans path against the manifest of the previous scan.
+
+    Files are compared by size, mtime_ns and inode, and only new, changed or deleted files
+    are yielded while the walk is still in progress. The manifest is left untouched; call
+    commit_manifest with the files once they have been processed, so that files of a run that
+    fails are reported again by the next scan.
+
+    Yields:
+        dict: {"status": "new" | "changed" | "deleted", "file_path": ...}
+    """
+    start = time.perf_counter()
+    manifest_path = manifest_path or manifest_path_for(path)
+    previous = load_manifest(manifest_path)
+    current = set()
+
+    for file_path, stat in iter_visible_files(path):
+        record = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        current.add(file_path)
+        old_record = previous.get(file_path)
+        if old_record is None:
+            yield {"status": "new", "file_path": file_path}
+        elif old_record != record:
+            yield {"status": "changed", "file_path": file_path}
+
+    for file_path in previous.keys() - current:
+        yield {"status": "deleted", "file_path": file_path}
+
+    # Time spent consuming the yielded changes is included, since the walk is interleaved with it
+    get_metrics().observe("scan", time.perf_counter() - start)
+
+def commit_manifest(path, file_paths, manifest_path=None):
+    """
+    Records the current state of file_paths in the manifest of path, so that the next scan only
+    reports them again once they change. Entries of files that no longer exist are dropped.
+    """
+    manifest_path = manifest_path or manifest_path_for(path)
+    manifest = {file_path: record for file_path, record in load_manifest(manifest_path).items() if os.path.lexists(file_path)}
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            manifest.pop(file_path, None)
+            continue
+        manifest[file_path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    save_manifest(manifest_path, manifest)
+
+def record_moves(path, moves, manifest_path=None):
+    """
+    Carries the manifest entries of moved files over to their new paths, so that files the
+    last scan already knew are not reported as new where they were moved to.
+
+    Args:
+        moves (iterable): (old_path, new_path) of every finished move.
+    """
+    manifest_path = manifest_path or manifest_path_for(path)
+    if not os.path.exists(manifest_path):
+        return
+    manifest = load_manifest(manifest_path)
+    for old_path, new_path in moves:
+        if manifest.pop(old_path, None) is None:
+            continue  # Not processed yet, so it stays new
+        try:
+            stat = os.stat(new_path)
+        except OSError:
+            continue
+        manifest[new_path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+    save_manifest(manifest_path, manifest)
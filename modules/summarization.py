@@ -1,23 +1,127 @@
+import os
 import json
 import requests
+from modules.cache import get_default_cache
+from modules.file_readers import prepare_image
+from modules.sampling import sample_content, trivial_summary
+from modules.metrics import get_metrics
+from modules.dispatcher import get_dispatcher
+from modules.json_utils import JsonObjectScanner, partial_string_field, parse_json_response, validate
+
+# Models can be swapped per role, e.g. to use one model for both summaries and the tree so that
+# a GPU does not have to keep two sets of weights loaded
+SUMMARY_MODEL = os.environ.get("ML_AUTO_SORTING_SUMMARY_MODEL", "llama3.2")
+SUMMARY_TIMEOUT = (5, 60)
+IMAGE_MODEL = os.environ.get("ML_AUTO_SORTING_IMAGE_MODEL", "moondream")
+
+# Ollama constrains the output to this schema, and replies are validated against it
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {"summary": {"type": "string"}},
+    "required": ["summary"]
+}
+# Additional attempts for a file whose reply fails validation
+SUMMARY_RETRIES = 1
+
+# Bump these whenever a prompt changes so that stale cached summaries are not reused
+SUMMARY_PROMPT_VERSION = "2"
+IMAGE_PROMPT_VERSION = "1"
+
+
+def lookup_cached_summary(file_data: dict, model: str, prompt_version: str, cache=None):
+    """
+    Returns (content_hash, cached summary or None) for the file described by file_data.
+
+    The content hash is taken from file_data["content_hash"] when present, otherwise it is
+    computed from the file at file_data["file_path"] (or "image_path"). Hits and misses are
+    counted in the run metrics as "cache.hits" and "cache.misses".
+    """
+    file_path = file_data.get("file_path") or file_data.get("image_path", "")
+    cache = cache or get_default_cache()
+    content_hash = file_data.get("content_hash")
+    if content_hash is None:
+        try:
+            content_hash = cache.digest(file_path)
+        except OSError:
+            return None, None
+    cached = cache.get(content_hash, model, prompt_version)
+    get_metrics().add("cache.misses" if cached is None else "cache.hits")
+    if cached is not None:
+        cached = dict(cached, file_name=file_data.get("file_name", ""), file_path=file_path, error=False)
+    return content_hash, cached
+
+
+def store_cached_summary(content_hash, model: str, prompt_version: str, summary: dict, cache=None):
+    if content_hash is None or summary.get("error"):
+        return
+    cache = cache or get_default_cache()
+    cache.put(content_hash, model, prompt_version, {"summary": summary.get("summary", "")})
 
-def summarize_with_ollama(file_data: dict) -> dict:
+
+def stream_json_response(payload: dict, timeout=None, on_partial=None) -> str:
+    """
+    Streams a generate request and returns the text of the first JSON object in the response.
+
+    The connection is closed as soon as the object is complete, so any trailing text the model
+    would produce afterwards is never generated. on_partial is called with the partial "summary"
+    value whenever it grows.
+    """
+    scanner = JsonObjectScanner()
+    raw_parts = []
+    last_partial = None
+    chunks = get_dispatcher().generate_stream(payload, timeout=timeout)
+    try:
+        for chunk in chunks:
+            raw_parts.append(chunk.get("response", ""))
+            if scanner.feed(raw_parts[-1]):
+                break
+            if on_partial:
+                partial = partial_string_field(scanner.text(), "summary")
+                if partial and partial != last_partial:
+                    last_partial = partial
+                    on_partial(partial)
+            if chunk.get("done"):
+                break
+    finally:
+        chunks.close()
+    # Fall back to the whole reply so that the tolerant parser can try to repair it
+    return scanner.text() if scanner.complete else "".join(raw_parts)
+
+
+def summarize_with_ollama(file_data: dict, cache=None, use_cache: bool = True, stream: bool = True,
+                          on_partial=None) -> dict:
     """
     Sends a prompt to Ollama's REST API and returns a concise summary of the file content.
+    Summaries of files whose content has not changed are served from the summary cache, and
+    empty or tiny files are summarized by their own text without asking the model.
     
     Args:
-        file_data (dict): Must contain "text", "file_name", and "file_path".
+        file_data (dict): Must contain "text", "file_name", and "file_path", and may contain an "outline".
+        cache (SummaryCache): Cache to use instead of the default one.
+        use_cache (bool): Whether to reuse and store summaries in the summary cache.
+        stream (bool): Whether to stream the response and stop reading once the JSON object is complete.
+        on_partial (callable): Called with the partial summary text while streaming.
     
     Returns:
         dict: A dictionary containing the summary and error flag.
     """
-    ollama_url = "http://localhost:11434/api/generate"
-    text_content = file_data.get("text", "")
     file_name = file_data.get("file_name", "")
     file_path = file_data.get("file_path", "")
 
-    # Truncate text to avoid overly large prompts
-    truncated_text = text_content[:5000]
+    summary = trivial_summary(file_data)
+    if summary is not None:
+        get_metrics().add("summarize.skipped_llm")
+        return {"summary": summary, "file_name": file_name, "file_path": file_path, "error": False}
+
+    # A "content_hash" means the caller has already looked the file up and missed
+    content_hash, cached = file_data.get("content_hash"), None
+    if use_cache and content_hash is None:
+        content_hash, cached = lookup_cached_summary(file_data, SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, cache)
+    if cached is not None:
+        return cached
+
+    # Only a token-budgeted sample of the content is sent, since prompt evaluation dominates latency
+    sampled_text = sample_content(file_data)
 
     # Strict prompt to request a single JSON object with only "summary"
     prompt = f"""
@@ -28,7 +132,7 @@ Constraints:
 
 File content:
 \"\"\"
-{truncated_text}
+{sampled_text}
 \"\"\"
 
 Return exactly:
@@ -39,70 +143,83 @@ No additional fields or text.
 """
 
     payload = {
-        "model": "llama3.2",  # Adjust if needed
+        "model": SUMMARY_MODEL,
         "prompt": prompt,
+        "format": SUMMARY_SCHEMA,
         "stream": False
     }
 
     try:
-        response = requests.post(ollama_url, json=payload, timeout=60)
-        if response.status_code != 200:
-            return {"summary": "No summary available.", "file_name": file_name, "file_path": file_path, "error": True}
-
-        # "response" is where Ollama places the model's text output
-        data = response.json()
-        raw_response = data.get("response", "").strip()
-
-        # Attempt to parse raw_response as JSON
-        try:
-            parsed_json = json.loads(raw_response)
-            parsed_json["file_name"] = file_name
-            parsed_json["file_path"] = file_path
-            parsed_json["error"] = False
+        for _ in range(SUMMARY_RETRIES + 1):
+            if stream:
+                raw_response = stream_json_response(payload, timeout=SUMMARY_TIMEOUT, on_partial=on_partial)
+            else:
+                # "response" is where Ollama places the model's text output
+                data = get_dispatcher().generate(payload, timeout=SUMMARY_TIMEOUT)
+                raw_response = data.get("response", "").strip()
+
+            # Attempt to parse raw_response as JSON, and only ask again if it cannot be repaired
+            try:
+                parsed_json = parse_json_response(raw_response)
+            except json.JSONDecodeError:
+                continue
+            if not validate(parsed_json, SUMMARY_SCHEMA):
+                continue
+            parsed_json = {"summary": parsed_json["summary"], "file_name": file_name, "file_path": file_path, "error": False}
+            store_cached_summary(content_hash, SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, parsed_json, cache)
             return parsed_json
-        except json.JSONDecodeError:
-            return {"summary": "No summary available.", "file_name": file_name, "file_path": file_path, "error": True}
+        return {"summary": "No summary available.", "file_name": file_name, "file_path": file_path, "error": True}
 
     except requests.exceptions.RequestException:
         return {"summary": "No summary available.", "file_name": file_name, "file_path": file_path, "error": True}
 
-def summarize_image_with_moondream(image_data: dict) -> dict:
+def summarize_image_with_moondream(image_data: dict, cache=None, use_cache: bool = True) -> dict:
     """
     Summarizes the content of an image using the Ollama Moondream API.
+    Summaries of images whose content has not changed are served from the summary cache.
 
     Args:
-        image_data (dict): Must contain "image_path" and "file_name".
+        image_data (dict): Must contain "image_path" and "file_name", and "image_b64" if the
+            image has already been downscaled by read_image.
+        cache (SummaryCache): Cache to use instead of the default one.
+        use_cache (bool): Whether to reuse and store summaries in the summary cache.
 
     Returns:
         dict: A dictionary containing the summary, file details, and error flag.
     """
-    api_url = "http://localhost:11434/api/generate"
+    # A "content_hash" means the caller has already looked the image up and missed
+    content_hash, cached = image_data.get("content_hash"), None
+    if use_cache and content_hash is None:
+        content_hash, cached = lookup_cached_summary(image_data, IMAGE_MODEL, IMAGE_PROMPT_VERSION, cache)
+    if cached is not None:
+        return cached
+
     image_path = image_data.get("image_path", "")
     file_name = image_data.get("file_name", "")
 
     try:
+        # Ollama only accepts base64-encoded images, not file paths
+        image_b64 = image_data.get("image_b64") or prepare_image(image_path)
+
         # Prepare the payload for the API
         payload = {
-            "model": "moondream",
+            "model": IMAGE_MODEL,
             "prompt": "Describe the contents of this image and summarize its features.",
-            "image": image_path,
+            "images": [image_b64],
             "stream": False
         }
 
         # Make the API request
-        response = requests.post(api_url, json=payload)
-        response.raise_for_status()
+        summary_data = get_dispatcher().generate(payload)
 
-        # Parse the response
-        summary_data = response.json()
-
-        # Return the summary
-        return {
+        summary = {
             "summary": summary_data.get("response", "No summary returned."),
             "file_path": image_path,
             "file_name": file_name,
             "error": False
         }
+        store_cached_summary(content_hash, IMAGE_MODEL, IMAGE_PROMPT_VERSION, summary, cache)
+        return summary
     except Exception as e:
         return {
             "summary": f"Error processing image: {e}",
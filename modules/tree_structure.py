@@ -1,24 +1,54 @@
-import json
+import os
+import re
+import logging
 import requests
-import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from modules.dispatcher import get_dispatcher
+from modules.json_utils import parse_json_response, validate
+from modules.sampling import estimate_tokens
 
-def generate_tree_structure(summaries, api_url="http://localhost:11434/api/generate"):
-    """
-    Generates a tree structure based on file summaries, names, and paths using Ollama's API.
-    
-    Args:
-        summaries (list): A list of dictionaries containing summaries, file names, and file paths.
-    
-    Returns:
-        dict: A JSON response containing the proposed tree structure with new file paths.
-    """
-    # Construct the prompt
-    summaries_text = "\n".join([f"File: {s['file_name']}\nSummary: {s['summary']}" for s in summaries])
+logger = logging.getLogger(__name__)
 
-    prompt = f"""
-    You must return strictly valid JSON, no extra formatting or keys.
+TREE_MODEL = os.environ.get("ML_AUTO_SORTING_TREE_MODEL", "llama3")
+
+# Approximate number of prompt tokens spent on file summaries per request
+DEFAULT_TOKEN_BUDGET = 3000
+DEFAULT_MAX_WORKERS = 4
+MAX_CATEGORIES = 12
+
+# Files of a batch that the model left out or answered invalidly are asked again this many times
+ASSIGN_RETRIES = 2
 
-    You will be provided with list of source files and a summary of their contents. For each file, propose a new path and filename, using a directory structure that optimally organizes the files.
+TAXONOMY_SCHEMA = {
+    "type": "object",
+    "properties": {"categories": {"type": "array", "items": {"type": "string"}}},
+    "required": ["categories"]
+}
+ASSIGNMENT_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "src_path": {"type": "string"},
+        "folder": {"type": "string"},
+        "file_name": {"type": "string"}
+    },
+    "required": ["src_path", "folder", "file_name"]
+}
+ASSIGNMENT_SCHEMA = {
+    "type": "object",
+    "properties": {"files": {"type": "array", "items": ASSIGNMENT_ITEM_SCHEMA}},
+    "required": ["files"]
+}
+# Replies are accepted as long as the list is there; broken entries are filtered out one by one
+ASSIGNMENT_REPLY_SCHEMA = {
+    "type": "object",
+    "properties": {"files": {"type": "array"}},
+    "required": ["files"]
+}
+
+# Characters of each summary shown to the model when proposing the taxonomy
+TAXONOMY_SUMMARY_CHARS = 150
+
+NAMING_GUIDELINES = """
     Follow good naming conventions. Here are a few guidelines:
     - Think about your files: What related files are you working with?
     - Identify metadata (for example, date, sample, experiment): What information is needed to easily locate a specific file?
@@ -28,43 +58,285 @@ def generate_tree_structure(summaries, api_url="http://localhost:11434/api/gener
 
     - The file name needs to be descriptive and concise.
     - Format file names: Avoid spaces, capital letters or special characters in your file names. Strictly use only lowercase and underscores instead.
+"""
+
+
+def format_summary(summary):
+    return f"File: {summary['file_path']}\nSummary: {summary['summary']}"
+
+
+def batch_summaries(summaries, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Splits summaries into batches whose formatted text fits in token_budget.
+    A summary that exceeds the budget on its own gets a batch of its own.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for summary in summaries:
+        tokens = estimate_tokens(format_summary(summary))
+        if current and current_tokens + tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(summary)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def request_json(prompt, api_url=None, schema=None, validation_schema=None):
+    """
+    Sends prompt to the tree model and returns the parsed JSON response.
+
+    The output is constrained to schema (or to any JSON if schema is None), repaired by the
+    tolerant parser if needed, and validated against validation_schema (defaults to schema).
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails.
+        ValueError: If the response is not valid JSON or does not match schema.
+    """
+    payload = {
+        "model": TREE_MODEL,
+        "prompt": prompt.strip(),
+        "format": schema or "json",
+        "stream": False
+    }
+    data = get_dispatcher().generate(payload, url=api_url)
+    parsed = parse_json_response(data.get("response", ""))
+    validation_schema = validation_schema or schema
+    if not isinstance(parsed, dict) or (validation_schema and not validate(parsed, validation_schema)):
+        raise ValueError("The response does not match the expected schema.")
+    return parsed
+
+
+def normalize_folder_name(name):
+    """
+    Normalizes a folder path to lowercase and underscores, e.g. "Meeting Notes/2024" -> "meeting_notes/2024".
+    """
+    parts = []
+    for part in re.split(r"[\\/]+", str(name)):
+        part = re.sub(r"[^0-9a-z]+", "_", part.strip().lower()).strip("_")
+        if part:
+            parts.append(part)
+    return "/".join(parts)
+
+
+def folder_key(name):
+    """
+    Returns the key folder names are matched by. Names without ASCII letters or digits, such as
+    "請求書", normalize to nothing and are compared as written instead.
+    """
+    return normalize_folder_name(name) or str(name).strip().lower()
+
+
+def propose_taxonomy(summaries, api_url=None, token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Asks the model for a list of top-level categories covering all summaries.
+
+    Only the file name and the beginning of each summary are sent. If they still exceed
+    token_budget, an evenly spaced sample of the summaries is used instead.
+    """
+    lines = [f"- {s['file_name']}: {s['summary'][:TAXONOMY_SUMMARY_CHARS]}" for s in summaries]
+    total_tokens = sum(estimate_tokens(line) for line in lines)
+    if total_tokens > token_budget:
+        step = total_tokens / token_budget
+        lines = [lines[int(i * step)] for i in range(max(1, int(len(lines) / step)))]
+
+    files_text = "\n".join(lines)
+    prompt = f"""
+    You must return strictly valid JSON, no extra formatting or keys.
+
+    You will be provided with a list of files and the beginning of a summary of their contents.
+    Propose at most {MAX_CATEGORIES} top-level folders that organize all of these files.
+    Folder names must use only lowercase letters, digits and underscores.
+
+    Files:
+    \"\"\"
+    {files_text}
+    \"\"\"
+
+    Your response must ONLY be a JSON object with the following schema:
+    {{
+        "categories": ["folder_name", "..."]
+    }}
+
+    Do not include any additional text or formatting."""
 
-    If the file is already named well or matches a known convention, set the destination path to the same as the source path.
-    The destination path should be placed under the current directory. Always return the full path.
+    data = request_json(prompt, api_url, TAXONOMY_SCHEMA)
+    categories = []
+    for category in data["categories"]:
+        category = normalize_folder_name(category)
+        if category and category not in categories:
+            categories.append(category)
+    return categories[:MAX_CATEGORIES]
+
+
+def assign_batch(batch, categories, api_url=None):
+    """
+    Asks the model to place every file in batch under one of categories and to propose a new file name.
+
+    Returns:
+        list: Dictionaries with "src_path", "folder" and "file_name".
+    """
+    summaries_text = "\n\n".join(format_summary(s) for s in batch)
+    if categories:
+        categories_text = "\n".join(f"- {c}" for c in categories)
+        folder_rule = f"""The folder must start with one of the following top-level folders. You may add one level of subfolder if it helps:
+    {categories_text}"""
+    else:
+        folder_rule = "Choose a folder that optimally organizes the files."
+
+    prompt = f"""
+    You must return strictly valid JSON, no extra formatting or keys.
+
+    You will be provided with list of source files and a summary of their contents. For each file, propose a folder and a new filename.
+    {folder_rule}
+    {NAMING_GUIDELINES}
+    If the file is already named well or matches a known convention, keep the same file name.
 
     Summaries:
     \"\"\"
-    {summaries}
+    {summaries_text}
     \"\"\"
-    
+
     Your response must ONLY be a JSON object with the following schema:
     {{
+        "files": [
             {{
                 "src_path": "original file path",
-                "summary": "original summary of the file content",
-                "dst_path": "new full file path"
+                "folder": "folder/subfolder",
+                "file_name": "new_file_name.ext"
             }}
         ]
     }}
 
     Do not include any additional text or formatting."""
 
-    payload = {
-        "model": "llama3",
-        "prompt": prompt.strip(),
-        "stream": False
-    }
+    data = request_json(prompt, api_url, ASSIGNMENT_SCHEMA, ASSIGNMENT_REPLY_SCHEMA)
+    # Keep the valid entries so that only the files with broken entries need to be asked again
+    return [item for item in data["files"] if validate(item, ASSIGNMENT_ITEM_SCHEMA)]
 
-    try:
-        response = requests.post(api_url, json=payload)
-        response.raise_for_status()
-
-        data = response.json()
-        tree_response = data.get("response", "").strip()
-        return json.loads(tree_response)
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error generating tree structure: {e}")
+
+def assign_with_retries(batch, categories, api_url=None):
+    """
+    Assigns batch, asking again only for the files that are missing or invalid in the reply.
+
+    Raises:
+        requests.exceptions.RequestException: If a request fails.
+        ValueError: If no file of the batch could be assigned.
+    """
+    assignments = []
+    remaining = batch
+    for attempt in range(ASSIGN_RETRIES + 1):
+        try:
+            items = assign_batch(remaining, categories, api_url)
+        except ValueError:
+            if attempt == ASSIGN_RETRIES and not assignments:
+                raise
+            continue
+        remaining_paths = {s["file_path"] for s in remaining}
+        assigned = [item for item in items if item["src_path"] in remaining_paths]
+        assignments.extend(assigned)
+        assigned_paths = {item["src_path"] for item in assigned}
+        remaining = [s for s in remaining if s["file_path"] not in assigned_paths]
+        if not remaining:
+            break
+    if not assignments:
+        raise ValueError("No file of the batch could be assigned.")
+    return assignments
+
+
+def merge_assignments(summaries, assignments, categories, existing=None):
+    """
+    Merges per-batch assignments into the final tree.
+
+    Folder names are normalized so that variants such as "Reports" and "reports " end up in
+    the same folder, and destination collisions are resolved by suffixing the file name.
+    Files the model did not assign keep their original path.
+
+    existing maps top-level folders that already exist on disk, by folder_key, to their real
+    names. Files assigned to one of them keep that name as is, so that they join the folder
+    instead of creating a normalized sibling.
+    """
+    by_src = {}
+    for item in assignments:
+        by_src.setdefault(item["src_path"], item)
+
+    canonical = {c.replace("_", ""): c for c in categories}
+    used_dst = set()
+    tree = []
+    for summary in summaries:
+        src_path = summary["file_path"]
+        item = by_src.get(src_path)
+        if item is None:
+            tree.append({"src_path": src_path, "summary": summary["summary"], "dst_path": src_path})
+            continue
+
+        parts = [part for part in re.split(r"[\\/]+", str(item.get("folder", ""))) if part.strip()]
+        if existing and parts and folder_key(parts[0]) in existing:
+            top, rest = existing[folder_key(parts[0])], normalize_folder_name("/".join(parts[1:]))
+        else:
+            folder = normalize_folder_name(item.get("folder", ""))
+            top, _, rest = folder.partition("/")
+            top = canonical.setdefault(top.replace("_", ""), top)
+        folder = f"{top}/{rest}" if rest else top
+
+        ext = os.path.splitext(src_path)[1]
+        stem = normalize_folder_name(os.path.splitext(item.get("file_name") or os.path.basename(src_path))[0]).replace("/", "_")
+        stem = stem or os.path.splitext(os.path.basename(src_path))[0]
+
+        dst_path = os.path.join(folder, stem + ext)
+        counter = 1
+        while dst_path in used_dst:
+            dst_path = os.path.join(folder, f"{stem}_{counter}{ext}")
+            counter += 1
+        used_dst.add(dst_path)
+        tree.append({"src_path": src_path, "summary": summary["summary"], "dst_path": dst_path})
+    return tree
+
+
+def generate_tree_structure(summaries, api_url=None,
+                            token_budget=DEFAULT_TOKEN_BUDGET, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Generates a tree structure based on file summaries, names, and paths using Ollama's API.
+
+    The summaries are split into batches that fit token_budget. A first pass proposes the
+    top-level categories, then the batches are assigned to categories in parallel and merged,
+    so the time per batch stays flat as the number of files grows.
+
+    Args:
+        summaries (list): A list of dictionaries containing summaries, file names, and file paths.
+        token_budget (int): Approximate number of summary tokens per request.
+        max_workers (int): Number of batches assigned in parallel.
+
+    Returns:
+        list: Dictionaries with "src_path", "summary" and "dst_path" (relative to the sorted directory).
+    """
+    if not summaries:
         return []
-    except json.JSONDecodeError:
-        st.error("Failed to decode the tree structure JSON.")
+
+    try:
+        categories = propose_taxonomy(summaries, api_url, token_budget)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # Without a taxonomy the batches still get sorted; the merge step unifies their folder names
+        logger.warning(f"Failed to propose top-level categories: {e}")
+        categories = []
+
+    batches = batch_summaries(summaries, token_budget)
+    assignments = []
+    failed_batches = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(assign_with_retries, batch, categories, api_url) for batch in batches]
+        for future in futures:
+            try:
+                assignments.extend(future.result())
+            except (requests.exceptions.RequestException, ValueError):
+                failed_batches += 1
+
+    if failed_batches == len(batches):
+        logger.error("Failed to generate the tree structure.")
         return []
+    if failed_batches:
+        logger.warning(f"Failed to generate the tree structure for {failed_batches} of {len(batches)} batches.")
+
+    return merge_assignments(summaries, assignments, categories)
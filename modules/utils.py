@@ -1,91 +1,212 @@
 import os
-import shutil
 import streamlit as st
 import pandas as pd
+from modules.executor import apply_plan, undo_plan, journal_path_for
+from modules.checkpoint import checkpoint_path_for, discard_checkpoint
+from modules.scanner import record_moves
 
-def list_visible_files_recursive(path):
-    file_list = []
-    for root, dirs, files in os.walk(path):
-        dirs[:] = [d for d in dirs if not d.startswith('.')]  # Exclude hidden dirs
-        for file in files:
-            if not file.startswith('.'):  # Exclude hidden files
-                full_path = os.path.join(root, file)
-                file_list.append(full_path)
-    return file_list
-
-def move_file(src, dst):
-    try:
-        if not os.path.exists(dst):
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            shutil.move(src, dst)
-            st.success(f"移動しました: {src} -> {dst}")
-        else:
-            st.warning(f"同名ファイルが既にあります: {dst}")
-    except Exception as e:
-        st.error(f"ファイルの移動に失敗しました: {e}")
-
-def on_move(src_path, dst_path, new_tree):
-    move_file(src_path, dst_path)
-    # Update the tree structure in session state
-    for item in new_tree:
-        if item["src_path"] == src_path:
-            item["dst_path"] = dst_path
-            break
-
-def on_reset(src_path, original_dst, new_tree):
-    current_dst = next((item["dst_path"] for item in new_tree if item["src_path"] == src_path), original_dst)
-    move_file(current_dst, src_path)
-    # Reset the destination path in new_tree
-    for item in new_tree:
-        if item["src_path"] == src_path:
-            item["dst_path"] = src_path
-            break
-
-def create_tree_buttons(new_tree, directory):
-    """
-    Create buttons in Streamlit for a tree structure based on the given new_tree.
-    """
-    st.write("移動実行ボタンを押すと、ファイルを移動できます。リセットボタンを押すと、変更を元に戻すことができます。    \n移動実行・リセットボタンを押すと、ローカル環境のディレクトリやファイル配下が変わるので注意して利用してください。")
+PAGE_SIZES = (50, 100, 200, 500)
+ALL_FOLDERS = "すべてのフォルダ"
+
+# Interacting with the plan view reruns only the view itself where Streamlit supports fragments
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+def init_plan_state():
+    if "moved" not in st.session_state:
+        reset_plan_state()
+
+def reset_plan_state():
+    st.session_state.inputs = {}
+    st.session_state.moved = {}
+    st.session_state.selected = set()
+    st.session_state.move_results = []
+    st.session_state.plan_editor_version = 0
+    # (journal_path, kind) of every apply ("apply") and move back ("reset") made in this session
+    st.session_state.journals = []
+
+def refresh_plan_editor():
+    # A new editor key drops edits the widget still holds, so the table shows the updated state
+    st.session_state.plan_editor_version += 1
 
-    for file in new_tree:
-        src_path = file["src_path"]
-        summary = file["summary"]
-        dst_path = os.path.join(directory, file["dst_path"])
-        original_dst = file.get("original_dst_path", dst_path)
+def destination_of(item, directory):
+    # Edited destinations may be relative to directory, and a cleared cell falls back to the proposal
+    return os.path.join(directory, st.session_state.inputs.get(item["src_path"]) or item["dst_path"])
 
-        # Editable directory path
-        text_input_key = f"text_input_{src_path}"
-        if src_path not in st.session_state.inputs:
-            st.session_state.inputs[src_path] = dst_path
+def show_move_results(results, done_status):
+    done = sum(1 for result in results if result["status"] == done_status)
+    errors = [result for result in results if result["status"] == "error"]
+    st.success(f"{done}ファイルを処理しました。")
+    for result in errors:
+        st.error(f"ファイルの移動に失敗しました: {result['src_path']} -> {result['dst_path']} ({result['error_msg']})")
 
-        new_dir_input = st.text_input(
-            f"移動先の編集 ({os.path.basename(src_path)}):",
-            value=st.session_state.inputs[src_path],
-            key=text_input_key
-        )
+def store_move_results(results, done_status):
+    # Button callbacks run before the view is drawn, so their results are shown by the view
+    st.session_state.move_results = [(results, done_status)]
+    refresh_plan_editor()
 
-        # Update the destination path in session state
-        st.session_state.inputs[src_path] = new_dir_input
-        file["dst_path"] = new_dir_input  # Update the new_tree with the new path
+def apply_journaled(plan, directory, kind):
+    journal_path = journal_path_for(directory)
+    st.session_state.journals.append((journal_path, kind))
+    results = apply_plan(plan, journal_path)
+    record_moves(directory, [(result["src_path"], result["dst_path"]) for result in results if result["status"] == "moved"])
+    return results
 
-        cols = st.columns([5, 3, 1, 1])
-        with cols[0]:
-            st.write(f"元ディレクトリ: `{src_path}`")
-            st.write(f"新ディレクトリ: `{new_dir_input}`")
+def apply_items(items, directory):
+    plan = [
+        {"src_path": item["src_path"], "dst_path": destination_of(item, directory)}
+        for item in items if item["src_path"] not in st.session_state.moved
+    ]
+    if not plan:
+        return
+    results = apply_journaled(plan, directory, "apply")
+    # The checkpointed run lists files at their old paths, so it can no longer be resumed
+    discard_checkpoint(checkpoint_path_for(directory))
+    st.session_state.checkpoint_info = None
+    store_move_results(results, "moved")
+    for result in results:
+        if result["status"] == "moved":
+            st.session_state.moved[result["src_path"]] = result["dst_path"]
 
-        with cols[1]:
-            st.write(f"*{summary}*")
+def on_apply_selected(new_tree, directory):
+    apply_items([item for item in new_tree if item["src_path"] in st.session_state.selected], directory)
 
-        with cols[2]:
-            if st.button(f"✅ 移動実行", key=f"move_{src_path}"):
-                on_move(src_path, new_dir_input, new_tree)
+def on_apply_all(new_tree, directory):
+    apply_items(new_tree, directory)
 
-        with cols[3]:
-            if st.button(f"🔄 リセット", key=f"reset_{src_path}"):
-                on_reset(src_path, original_dst, new_tree)
+def on_reset_selected(directory):
+    # Moving the files back is journaled like any other move
+    moved = st.session_state.moved
+    plan = [{"src_path": dst, "dst_path": src} for src, dst in moved.items() if src in st.session_state.selected]
+    if not plan:
+        return
+    results = apply_journaled(plan, directory, "reset")
+    store_move_results(results, "moved")
+    for result in results:
+        if result["status"] == "moved":
+            moved.pop(result["dst_path"], None)
+
+def on_undo_all(directory):
+    # Each selective move or move back has its own journal, so all of them are undone, newest first
+    results = []
+    while st.session_state.journals:
+        journal_path, kind = st.session_state.journals.pop()
+        journal_results = undo_plan(journal_path)
+        results.extend(journal_results)
+        record_moves(directory, [
+            (result["dst_path"], result["src_path"]) for result in journal_results if result["status"] == "restored"
+        ])
+        for result in journal_results:
+            if result["status"] != "restored":
+                continue
+            if kind == "apply":
+                st.session_state.moved.pop(result["src_path"], None)
+            else:
+                # Undoing a move back puts the file at its applied destination again
+                st.session_state.moved[result["dst_path"]] = result["src_path"]
+    store_move_results(results, "restored")
+
+def on_select_page(src_paths, selected):
+    if selected:
+        st.session_state.selected.update(src_paths)
+    else:
+        st.session_state.selected.difference_update(src_paths)
+    refresh_plan_editor()
+
+def plan_folder(item):
+    return os.path.dirname(item["dst_path"]) or "."
+
+@_fragment
+def create_plan_editor(new_tree, directory):
+    """
+    Show the proposed tree as an editable table, one page at a time.
+
+    Files are grouped by destination folder and can be filtered. Destinations are edited in place,
+    and the selected files are moved (or moved back) in bulk through the journaled executor.
+    """
+    init_plan_state()
+    st.write("移動先を編集し、チェックしたファイルをまとめて移動できます。    \n移動を実行すると、ローカル環境のディレクトリやファイル配下が変わるので注意して利用してください。")
+    for results, done_status in st.session_state.move_results:
+        show_move_results(results, done_status)
+    st.session_state.move_results = []
 
-        # Add spacing between file entries
-        st.markdown("---")
+    folders = sorted({plan_folder(item) for item in new_tree})
+    filter_cols = st.columns([2, 3, 1, 1])
+    with filter_cols[0]:
+        folder = st.selectbox("移動先フォルダ", [ALL_FOLDERS] + folders, key="plan_folder")
+    with filter_cols[1]:
+        query = st.text_input("絞り込み（ファイル名・移動先・要約）", key="plan_query").strip().lower()
+    with filter_cols[2]:
+        page_size = st.selectbox("表示件数", PAGE_SIZES, key="plan_page_size")
+
+    items = [
+        item for item in sorted(new_tree, key=lambda item: (plan_folder(item), item["src_path"]))
+        if (folder == ALL_FOLDERS or plan_folder(item) == folder)
+        and (not query or any(query in text.lower() for text in (item["src_path"], destination_of(item, directory), item["summary"])))
+    ]
+    page_count = max(1, -(-len(items) // page_size))
+    with filter_cols[3]:
+        page = st.number_input(f"ページ（全{page_count}）", min_value=1, max_value=page_count, value=1, key="plan_page")
+    page_items = items[(page - 1) * page_size:page * page_size]
+
+    def duplicate_marker(item):
+        if item.get("duplicate_of"):
+            return f"🔁 {item['duplicate_of']}"
+        if item.get("near_duplicate_of"):
+            return f"≈ {item['near_duplicate_of']}"
+        return ""
+
+    df_page = pd.DataFrame([
+        {
+            "選択": item["src_path"] in st.session_state.selected,
+            "元ファイル": item["src_path"],
+            "移動先": destination_of(item, directory),
+            "要約": item["summary"],
+            "重複": duplicate_marker(item),
+            "状態": "移動済み" if item["src_path"] in st.session_state.moved else ""
+        }
+        for item in page_items
+    ], columns=["選択", "元ファイル", "移動先", "要約", "重複", "状態"])
+
+    # Only the current page is sent to the browser, so redraws stay fast for large plans
+    edited = st.data_editor(
+        df_page,
+        key=f"plan_editor_{st.session_state.plan_editor_version}_{folder}_{query}_{page_size}_{page}",
+        hide_index=True,
+        disabled=["元ファイル", "要約", "重複", "状態"],
+        column_config={
+            "選択": st.column_config.CheckboxColumn(width="small"),
+            "移動先": st.column_config.TextColumn(width="large"),
+        }
+    )
+    for row in edited.itertuples(index=False):
+        src_path, selected, dst_path = row[1], row[0], row[2]
+        if isinstance(dst_path, str) and dst_path.strip():
+            st.session_state.inputs[src_path] = dst_path.strip()
+        else:
+            st.session_state.inputs.pop(src_path, None)
+        if selected:
+            st.session_state.selected.add(src_path)
+        else:
+            st.session_state.selected.discard(src_path)
+    st.caption(f"{len(items)}件中 {len(page_items)}件を表示 ・ 選択中: {len(st.session_state.selected)}件 ・ 移動済み: {len(st.session_state.moved)}件")
+
+    page_paths = [item["src_path"] for item in page_items]
+    bulk_cols = st.columns(6)
+    with bulk_cols[0]:
+        st.button("☑️ ページをすべて選択", key="select_page", on_click=on_select_page, args=(page_paths, True))
+    with bulk_cols[1]:
+        st.button("⬜ ページの選択を解除", key="deselect_page", on_click=on_select_page, args=(page_paths, False))
+    with bulk_cols[2]:
+        st.button("✅ 選択したファイルを移動", key="move_selected", on_click=on_apply_selected,
+                  args=(new_tree, directory), disabled=not st.session_state.selected)
+    with bulk_cols[3]:
+        st.button("🔄 選択したファイルを戻す", key="reset_selected", on_click=on_reset_selected,
+                  args=(directory,), disabled=not st.session_state.selected.intersection(st.session_state.moved))
+    with bulk_cols[4]:
+        st.button("📦 すべて移動実行", key="move_all", on_click=on_apply_all, args=(new_tree, directory))
+    with bulk_cols[5]:
+        st.button("↩️ 一括で元に戻す", key="undo_all", on_click=on_undo_all, args=(directory,),
+                  disabled=not st.session_state.journals)
 
 def display_error_files(error_files):
     """
@@ -106,3 +227,42 @@ def display_error_files(error_files):
         
         df_errors = pd.DataFrame(error_data)
         st.table(df_errors)
+
+def display_metrics(metrics):
+    """
+    Display per-stage timings, the slowest files and the LLM token counters of the last run.
+    """
+    stages = metrics.summary()
+    if not stages:
+        return
+    with st.expander("パフォーマンス"):
+        df_stages = pd.DataFrame([
+            {
+                "処理": stage,
+                "件数": values["count"],
+                "エラー": values["errors"],
+                "p50 (秒)": values["p50_seconds"],
+                "p95 (秒)": values["p95_seconds"],
+                "合計 (秒)": values["total_seconds"]
+            }
+            for stage, values in stages.items()
+        ])
+        st.dataframe(df_stages, hide_index=True)
+
+        slowest = metrics.slowest(10)
+        if slowest:
+            st.subheader("時間のかかったファイル")
+            st.dataframe(pd.DataFrame([
+                {"ファイル": item["file_path"], "処理": item["stage"], "秒": item["seconds"]}
+                for item in slowest
+            ]), hide_index=True)
+
+        counters = metrics.to_dict()["counters"]
+        if counters:
+            st.subheader("カウンター")
+            st.dataframe(pd.DataFrame([
+                {"項目": name, "値": value} for name, value in sorted(counters.items())
+            ]), hide_index=True)
+
+        st.download_button("JSONでダウンロード", metrics.to_json(), file_name="metrics.json", mime="application/json")
+        st.download_button("Prometheus形式でダウンロード", metrics.to_prometheus(), file_name="metrics.prom", mime="text/plain")
@@ -0,0 +1,236 @@
+import os
+import time
+import queue
+import logging
+import threading
+import requests
+from modules.engine import summarize_files, resolve_plan
+from modules.tree_structure import assign_with_retries, merge_assignments, folder_key
+from modules.executor import apply_plan, journal_path_for
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # watchdog is optional; without it the inbox is polled
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+# A file is processed once its size and mtime have not changed for this long
+DEFAULT_SETTLE_SECONDS = 2.0
+DEFAULT_POLL_INTERVAL = 1.0
+# Files placed per LLM request, so that a burst of arrivals does not delay the first ones
+MAX_BATCH_SIZE = 20
+
+# Names used by browsers and copy tools while a file is still being written
+IGNORED_SUFFIXES = (".partial", ".part", ".tmp", ".crdownload", ".download")
+
+
+def is_candidate(file_path):
+    name = os.path.basename(file_path)
+    return not name.startswith((".", "~$")) and not name.lower().endswith(IGNORED_SUFFIXES)
+
+
+def list_inbox(inbox):
+    """
+    Lists the candidate files directly inside inbox. Subfolders hold sorted files and are not descended into.
+    """
+    try:
+        with os.scandir(inbox) as entries:
+            return [entry.path for entry in entries if entry.is_file() and is_candidate(entry.path)]
+    except OSError:
+        return []
+
+
+def existing_categories(target):
+    """
+    Returns the top-level folders of the sorted tree, which new files are placed into, as a dict
+    from folder_key to the real folder name. Only the top level is listed, so the cost does not
+    grow with the number of sorted files.
+    """
+    try:
+        with os.scandir(target) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+    except OSError:
+        return {}
+    folders = {}
+    for name in names:
+        folders.setdefault(folder_key(name), name)
+    folders.pop("", None)
+    return folders
+
+
+def unique_destination(dst_path):
+    # The executor never overwrites, so pick a free name next to files sorted earlier
+    stem, ext = os.path.splitext(dst_path)
+    counter = 1
+    while os.path.exists(dst_path):
+        dst_path = f"{stem}_{counter}{ext}"
+        counter += 1
+    return dst_path
+
+
+class SettleTracker:
+    """
+    Debounces partially written files by waiting until their size and mtime stop changing.
+    """
+
+    def __init__(self, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.settle_seconds = settle_seconds
+        self.pending = {}
+
+    def touch(self, file_path):
+        if is_candidate(file_path):
+            self.pending.setdefault(file_path, (None, 0.0))
+
+    def ready(self, now=None):
+        """
+        Returns the pending files whose state has been stable for settle_seconds and stops tracking them.
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        for file_path, (state, since) in list(self.pending.items()):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self.pending[file_path]  # Deleted or moved away before it settled
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != state:
+                self.pending[file_path] = (current, now)
+            elif now - since >= self.settle_seconds:
+                del self.pending[file_path]
+                ready.append(file_path)
+        return ready
+
+
+class InboxEventHandler(FileSystemEventHandler):
+    def __init__(self, events):
+        self.events = events
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.events.put(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.events.put(event.dest_path)
+
+
+def place_files(file_paths, target, read_workers=None, model_concurrency=None, use_cache=True):
+    """
+    Summarizes file_paths and moves them into the existing folders of target.
+
+    Returns:
+        list: The executor results, one per file with a destination.
+    """
+    summaries, error_files = summarize_files(
+        file_paths, read_workers=read_workers, model_concurrency=model_concurrency, use_cache=use_cache
+    )
+    for error_file in error_files:
+        logger.warning("Could not summarize %s: %s", error_file.get("file_path"), error_file.get("summary"))
+    if not summaries:
+        return []
+
+    folders = existing_categories(target)
+    # The model sees the real folder names, and its answers are mapped back to them
+    categories = sorted(folders.values())
+    try:
+        assignments = assign_with_retries(summaries, categories)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("Could not place %d files: %s", len(summaries), e)
+        return []
+
+    plan = [
+        dict(item, dst_path=unique_destination(item["dst_path"]))
+        for item in resolve_plan(merge_assignments(summaries, assignments, categories, folders), target)
+        if item["dst_path"] != item["src_path"]  # Files the model did not place stay in the inbox
+    ]
+    if not plan:
+        return []
+    results = apply_plan(plan, journal_path_for(target))
+    for result in results:
+        if result["status"] == "error":
+            logger.error("Failed to move %s -> %s: %s", result["src_path"], result["dst_path"], result["error_msg"])
+        else:
+            logger.info("Sorted %s -> %s", result["src_path"], result["dst_path"])
+    return results
+
+
+def watch(inbox, target=None, settle_seconds=DEFAULT_SETTLE_SECONDS, poll_interval=DEFAULT_POLL_INTERVAL,
+          use_watchdog=True, stop_event=None, read_workers=None, model_concurrency=None, use_cache=True):
+    """
+    Watches inbox and sorts every new file into the existing tree of target as soon as it is fully written.
+
+    Filesystem events come from watchdog (inotify on Linux) when it is installed; otherwise the
+    inbox is polled every poll_interval seconds. Files already in the inbox when the watch starts
+    are sorted as well. New files are placed into the top-level folders already present in target
+    instead of regenerating the whole tree.
+
+    Args:
+        inbox (str): Directory that receives new files. Only files directly inside it are sorted.
+        target (str): Root of the sorted tree (defaults to inbox).
+        settle_seconds (float): How long a file must stay unchanged before it is processed.
+        stop_event (threading.Event): Stops the watch when set. Runs until interrupted otherwise.
+    """
+    # Files the model does not place keep their source path, which must be absolute to resolve against target
+    inbox = os.path.abspath(inbox)
+    target = os.path.abspath(target or inbox)
+    stop_event = stop_event or threading.Event()
+    tracker = SettleTracker(settle_seconds)
+    events = queue.Queue()
+    # Files that could not be placed stay in the inbox; they are only retried once they change
+    attempted = {}
+
+    observer = None
+    if use_watchdog and Observer is not None:
+        observer = Observer()
+        observer.schedule(InboxEventHandler(events), inbox, recursive=False)
+        observer.start()
+        logger.info("Watching %s for new files", inbox)
+    else:
+        logger.info("Polling %s for new files every %.1f seconds", inbox, poll_interval)
+
+    for file_path in list_inbox(inbox):
+        tracker.touch(file_path)
+
+    try:
+        while not stop_event.is_set():
+            if observer is None:
+                for file_path in list_inbox(inbox):
+                    tracker.touch(file_path)
+            while True:
+                try:
+                    file_path = events.get_nowait()
+                except queue.Empty:
+                    break
+                if os.path.dirname(os.path.abspath(file_path)) == inbox:
+                    tracker.touch(file_path)
+
+            ready = []
+            for file_path in tracker.ready():
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                state = (stat.st_size, stat.st_mtime_ns)
+                if attempted.get(file_path) != state:
+                    attempted[file_path] = state
+                    ready.append(file_path)
+            for start in range(0, len(ready), MAX_BATCH_SIZE):
+                results = place_files(ready[start:start + MAX_BATCH_SIZE], target, read_workers, model_concurrency, use_cache)
+                for result in results:
+                    if result["status"] == "moved":
+                        attempted.pop(result["src_path"], None)
+
+            stop_event.wait(poll_interval)
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()